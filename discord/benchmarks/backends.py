@@ -0,0 +1,78 @@
+"""Write path throughput of each storage backend.
+
+Plays the same stream of bets, payouts and transfers through the storage
+backends directly and through AsyncEconomy as the cogs use it, both
+writing every change through and writing behind.
+
+Run from the discord/ folder:
+
+    python -m benchmarks.backends [operations] [accounts]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from modules.economy import BACKENDS, AsyncEconomy
+
+
+def report(label: str, operations: int, elapsed: float):
+    print(f"{label:<45}{operations / elapsed:>12,.0f} ops/s")
+
+
+def workload(operations: int, accounts: int):
+    random.seed(0)
+    for _ in range(operations):
+        user_id = random.randrange(accounts)
+        roll = random.random()
+        if roll < 0.6:
+            bet = random.randint(1, 100)
+            yield "settle_bet", (user_id, bet, random.choice((-bet, bet)))
+        elif roll < 0.9:
+            yield "add_money", (user_id, random.randint(1, 100))
+        else:
+            other = random.randrange(accounts)
+            yield "transfer", ([(user_id, -10, 0, 0), (other, 10, 0, 0)],)
+
+
+def run_sync(backend: str, path: str, operations: int, accounts: int):
+    economy = BACKENDS[backend](path=path)
+    ops = list(workload(operations, accounts))
+    start = time.perf_counter()
+    for name, args in ops:
+        getattr(economy, name)(*args)
+    report(f"{backend}, direct", operations, time.perf_counter() - start)
+    economy.close()
+
+
+async def run_async(
+    backend: str, path: str, flush_interval: float, operations: int, accounts: int
+):
+    economy = AsyncEconomy(backend=backend, path=path, flush_interval=flush_interval)
+    ops = list(workload(operations, accounts))
+    start = time.perf_counter()
+    for name, args in ops:
+        await getattr(economy, name)(*args)
+    await economy.flush()
+    label = "write-through" if not flush_interval else "write-behind"
+    report(f"{backend}, AsyncEconomy {label}", operations, time.perf_counter() - start)
+    await economy.close()
+
+
+def main(operations: int = 20_000, accounts: int = 1_000):
+    for backend in BACKENDS:
+        for flush_interval in (None, 0, 2):
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, "economy.db")
+                if flush_interval is None:
+                    run_sync(backend, path, operations, accounts)
+                else:
+                    asyncio.run(
+                        run_async(backend, path, flush_interval, operations, accounts)
+                    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
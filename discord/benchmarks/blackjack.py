@@ -0,0 +1,92 @@
+"""Per-table cost of drawing the blackjack table.
+
+Plays through the frames of a few hundred games and compares opening and
+decoding every card PNG and the table on each render, as the job used
+to, with drawing card by card off the CardAtlas loaded once. Times are
+split by how many cards the player holds, then the PNG encoder's share
+of a render is shown.
+
+Run from the discord/ folder:
+
+    python -m benchmarks.blackjack [games]
+"""
+import random
+import sys
+import time
+from typing import List
+
+from PIL import Image
+
+from modules.card import Card
+from modules.card_atlas import FOLDER, CardAtlas, TableRenderer
+from modules.render import png
+
+
+def file_table(hands: List[List[str]]) -> Image.Image:
+    """How the job drew tables before the atlas"""
+    images = [[Image.open(FOLDER / "cards" / card) for card in hand] for hand in hands]
+    bg = Image.open(FOLDER / "table.png")
+    img_w, img_h = images[0][0].size
+    start_y = bg.size[1] // 2 - ((len(images) * img_h + (len(images) - 1) * 15) // 2)
+    for hand in images:
+        start_x = bg.size[0] // 2 - ((len(hand) * img_w + (len(hand) - 1) * 10) // 2)
+        for card in hand:
+            bg.alpha_composite(card, (start_x, start_y))
+            start_x += img_w + 10
+        start_y += img_h + 15
+    return bg
+
+
+def games(count: int) -> List[List[List[List[str]]]]:
+    """The frames of each game: the deal, one per hit up to six player
+    cards, then the reveal with the dealer drawing two more"""
+    random.seed(0)
+    deck = [Card(suit, value) for suit in Card.suits for value in range(2, 15)]
+    played = []
+    for _ in range(count):
+        random.shuffle(deck)
+        cards = [card.image for card in deck]
+        dealer = [cards[0], "red_back.png"]
+        frames = [[dealer, cards[2 : 2 + hand]] for hand in range(2, 7)]
+        frames.append([cards[:2] + cards[8:10], cards[2:8]])
+        played.append(frames)
+    return played
+
+
+def timed_draw(label: str, draw, frames: List[List[List[str]]]):
+    """Mean draw time of the frames, by cards in the player's hand"""
+    by_hand = {}
+    for table in frames:
+        start = time.perf_counter()
+        draw(table)
+        by_hand.setdefault(len(table[1]), []).append(time.perf_counter() - start)
+    times = "".join(
+        f"{sum(t) / len(t) * 1000:>8.3f}" for _, t in sorted(by_hand.items())
+    )
+    print(f"{label:<37}{times}  ms/table")
+
+
+def main(count: int = 200):
+    frames = [table for game in games(count) for table in game]
+
+    start = time.perf_counter()
+    atlas = CardAtlas()
+    print(f"atlas loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for key, value in atlas.stats().items():
+        print(f"  {key:<20}{value:>12,}")
+
+    print(f"{'player cards':<37}" + "".join(f"{n:>8}" for n in range(2, 7)))
+    timed_draw("draw, decoding the card files", file_table, frames)
+    renderer = TableRenderer(atlas)
+    timed_draw("draw, card by card from the atlas", renderer.draw, frames)
+
+    drawn = [renderer.draw(table) for table in frames]
+    start = time.perf_counter()
+    for image in drawn:
+        png(image)
+    elapsed = time.perf_counter() - start
+    print(f"{'encode PNG':<37}{elapsed / len(drawn) * 1000:>8.3f}  ms/table")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,84 @@
+"""Leaderboard read cost against a large synthetic economy table.
+
+Run from the discord/ folder:
+
+    python -m benchmarks.leaderboard [accounts]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from modules.economy import Economy
+from modules.leaderboard import Leaderboard
+
+
+def timed(label, func, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<45}{elapsed * 1000:>12.3f} ms")
+    return result
+
+
+def main(accounts: int = 1_000_000):
+    with tempfile.TemporaryDirectory() as path:
+        os.chdir(path)
+        run(accounts)
+
+
+def run(accounts: int):
+    conn = sqlite3.connect("economy.db")
+    conn.execute(
+        """CREATE TABLE economy (
+        user_id INTEGER NOT NULL PRIMARY KEY,
+        money INTEGER NOT NULL DEFAULT 0,
+        credits INTEGER NOT NULL DEFAULT 0,
+        kidneys INTEGER NOT NULL DEFAULT 2
+    )"""
+    )
+    timed(
+        f"insert {accounts:,} accounts",
+        lambda: conn.executemany(
+            "INSERT INTO economy VALUES(?,?,?,2)",
+            (
+                (user_id, random.randint(0, 10**7), random.randint(0, 100))
+                for user_id in range(accounts)
+            ),
+        ),
+    )
+    conn.commit()
+
+    def full_sort():
+        cur = conn.execute("SELECT * FROM economy ORDER BY money DESC")
+        return cur.fetchmany(5)
+
+    timed("top 5, no index (old top_entries)", full_sort, repeat=3)
+    conn.close()
+
+    economy = timed(
+        "open Economy (builds the indexes)", lambda: Economy(path="economy.db")
+    )
+    timed("top 5, money index", lambda: economy.top_entries(5), repeat=100)
+
+    board = Leaderboard(10)
+    board.load(economy.top_entries(board.capacity))
+    timed("top 5, in-memory leaderboard", lambda: board.top(5), repeat=10000)
+
+    updates = [
+        (random.randrange(accounts), random.randint(0, 10**7), 0, 2)
+        for _ in range(100_000)
+    ]
+    start = time.perf_counter()
+    for entry in updates:
+        board.update(entry)
+    elapsed = time.perf_counter() - start
+    print(f"{'leaderboard update':<45}{elapsed / len(updates) * 1e6:>12.3f} us")
+    economy.close()
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
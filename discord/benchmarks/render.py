@@ -0,0 +1,51 @@
+"""Render throughput with and without the worker pool.
+
+Submits a burst of blackjack tables and uncached slot spins at once, as a
+busy bot would, and times how long they take to come back.
+
+Run from the discord/ folder:
+
+    python -m benchmarks.render [jobs]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+from modules.render import RenderService, blackjack_table
+from modules.slot_machine import render_spin
+
+CARDS = [f"{value}{suit}" for value in "23456789JQKA" for suit in "CDHS"]
+
+
+def jobs(count: int):
+    random.seed(0)
+    for i in range(count):
+        if i % 2:
+            hands = [[f"{random.choice(CARDS)}.png" for _ in range(3)] for _ in "12"]
+            yield blackjack_table, (hands,)
+        else:
+            yield render_spin, (tuple(random.randint(1, 29) for _ in range(3)),)
+
+
+async def burst(workers: int, count: int):
+    render = RenderService(workers=workers)
+    # Lets every worker load its art before timing
+    await asyncio.gather(*(render.run(job, *args) for job, args in jobs(workers)))
+    start = time.perf_counter()
+    await asyncio.gather(*(render.run(job, *args) for job, args in jobs(count)))
+    elapsed = time.perf_counter() - start
+    render.close()
+    label = f"{workers} workers" if workers else "inline"
+    print(f"{label:<45}{count / elapsed:>12,.1f} jobs/s")
+
+
+def main(count: int = 200):
+    cores = os.cpu_count()
+    for workers in sorted({0, 1, cores // 2, cores}):
+        asyncio.run(burst(workers, count))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,66 @@
+"""Write throughput with the economy split over 1 or more SQLite files.
+
+Many players betting at once with every change written through, then one
+big write-behind flush, for each shard count.
+
+Run from the discord/ folder:
+
+    python -m benchmarks.shards [operations] [accounts] [max shards]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from modules.economy import AsyncEconomy
+
+
+async def players(economy: AsyncEconomy, operations: int, accounts: int):
+    """64 concurrent players, each settling bets and sometimes giving money"""
+
+    async def player():
+        for _ in range(operations // 64):
+            user_id = random.randrange(accounts)
+            if random.random() < 0.9:
+                await economy.settle_bet(user_id, 0, random.randint(-50, 50))
+            else:
+                other = random.randrange(accounts)
+                await economy.transfer([(user_id, -1, 0, 0), (other, 1, 0, 0)])
+
+    await asyncio.gather(*(player() for _ in range(64)))
+
+
+async def run(shards: int, path: str, operations: int, accounts: int):
+    economy = AsyncEconomy(path=path, shards=shards, flush_interval=0)
+    await economy.transfer_many([[(i, 1000, 0, 0)] for i in range(accounts)])
+
+    start = time.perf_counter()
+    await players(economy, operations, accounts)
+    elapsed = time.perf_counter() - start
+    label = f"{shards} shard(s), write-through"
+    print(f"{label:<45}{operations / elapsed:>12,.0f} ops/s")
+
+    economy.flush_interval = 2
+    for user_id in range(accounts):
+        await economy.add_money(user_id, 1)
+    start = time.perf_counter()
+    await economy.flush()
+    elapsed = time.perf_counter() - start
+    label = f"{shards} shard(s), flush {accounts:,} accounts"
+    print(f"{label:<45}{elapsed * 1000:>12.1f} ms")
+    await economy.close()
+
+
+def main(operations: int = 20_000, accounts: int = 100_000, max_shards: int = 4):
+    shards = 1
+    while shards <= max_shards:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "economy.db")
+            asyncio.run(run(shards, path, operations, accounts))
+        shards *= 2
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,125 @@
+"""Per-spin cost of drawing and encoding the slot machine animation.
+
+Compares loading and scaling the art on every spin, as the cog used to,
+with drawing from a SlotMachine loaded once, and drawing the frames with
+PIL, one paste per reel, against the NumPy compositor. Then compares the
+encode time and upload size of the spin and result images: GIFs with a
+palette picked per frame, as the cog used to, against the shared palette
+and the other formats.
+
+Run from the discord/ folder:
+
+    python -m benchmarks.slots [spins]
+"""
+import io
+import random
+import sys
+import time
+
+from PIL import Image
+
+from modules.slot_machine import RESULT_FORMATS, SPINNING_FORMATS, SlotMachine
+
+
+def report(label: str, spins: int, elapsed: float, size: int = None):
+    line = f"{label:<45}{elapsed / spins * 1000:>12.3f} ms/spin"
+    if size is not None:
+        line += f"{size / spins / 1024:>12.1f} KiB"
+    print(line)
+
+
+def adaptive_gif(images, duration, loop) -> bytes:
+    """How the cog encoded GIFs before the shared palette"""
+    with io.BytesIO() as image_binary:
+        images[0].save(
+            image_binary,
+            format="GIF",
+            save_all=True,
+            append_images=images[1:],
+            duration=duration,
+            loop=loop,
+            optimize=True,
+        )
+        return image_binary.getvalue()
+
+
+def timed_encode(label: str, encode, frames):
+    size = 0
+    start = time.perf_counter()
+    for images in frames:
+        size += len(encode(images))
+    report(label, len(frames), time.perf_counter() - start, size)
+
+
+def pil_frames(machine: SlotMachine, stops):
+    """How the cog drew frames before the NumPy compositor"""
+    rw = machine.reel.width
+    images = []
+    for i in range(1, (machine.item // machine.speed) + 1):
+        bg = Image.new("RGBA", machine.facade.size, color=(255, 255, 255))
+        for column, stop in enumerate(stops):
+            bg.paste(machine.reel, (25 + rw * column, 100 - (machine.speed * i * stop)))
+        bg.alpha_composite(machine.facade)
+        images.append(bg)
+    return images
+
+
+def spins(machine: SlotMachine, count: int):
+    random.seed(0)
+    return [
+        tuple(random.randint(1, machine.items - 1) for _ in range(3))
+        for _ in range(count)
+    ]
+
+
+def main(count: int = 50):
+    machine = SlotMachine()
+    stops = spins(machine, count)
+
+    start = time.perf_counter()
+    for spin in stops:
+        pil_frames(SlotMachine(), spin)
+    report("load art every spin", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for spin in stops:
+        pil_frames(machine, spin)
+    report("art loaded once, PIL compositor", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for spin in stops:
+        machine.frames(spin)
+    report("art loaded once, NumPy compositor", count, time.perf_counter() - start)
+
+    frames = [machine.frames(spin) for spin in stops]
+    machine.palette  # Worked out once per machine, not per spin
+    spinning = [images[:-1] for images in frames]
+    results = [images[-1:] for images in frames]
+    # The old encoder got RGBA frames from PIL
+    old_frames = [pil_frames(machine, spin) for spin in stops]
+    timed_encode(
+        "spin: gif, palette per frame",
+        lambda images: adaptive_gif(images, 430, 1),
+        [images[:-1] for images in old_frames],
+    )
+    for format in SPINNING_FORMATS:
+        timed_encode(
+            f"spin: {format}",
+            lambda images: machine.encode(images, format, 430, 1),
+            spinning,
+        )
+    timed_encode(
+        "result: gif, palette per frame",
+        lambda images: adaptive_gif(images, 1000, 0),
+        [images[-1:] for images in old_frames],
+    )
+    for format in RESULT_FORMATS:
+        timed_encode(
+            f"result: {format}",
+            lambda images: machine.encode(images, format, 1000, 0),
+            results,
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -2,15 +2,48 @@ import discord
 from discord.ext import commands
 import os
 import asyncio
+from modules.card_atlas import card_atlas
+from modules.economy import AsyncEconomy
+from modules.maintenance import Maintenance
+from modules.outbox import Outbox
+from modules.render import RenderService
+from modules.sessions import SessionRegistry
 from modules.helpers import *
 
 intents = discord.Intents.default()
 intents.message_content = True  # Ensure to enable necessary intents
 
-client = commands.Bot(command_prefix=PREFIX, owner_ids=OWNER_IDS, intents=intents)
+
+class CasinoBot(commands.Bot):
+    async def setup_hook(self):
+        self.maintenance.start()
+
+    async def close(self):
+        # Sends the results still queued while the connection is up
+        await self.outbox.close()
+        await super().close()
+        await self.maintenance.stop()
+        # Writes out any balance changes still held in memory
+        await self.economy.close()
+        self.render.close()
+
+
+client = CasinoBot(command_prefix=PREFIX, owner_ids=OWNER_IDS, intents=intents)
 
 client.remove_command("help")
 
+# Decoded before the render workers fork, so every worker starts with it
+card_atlas()
+# Forks its workers straight away, so has to come before the economy threads
+client.render = RenderService(**RENDER_CONFIG)
+# Shared by every cog, so the bot holds a single writer connection
+client.economy = AsyncEconomy(**ECONOMY_CONFIG)
+client.maintenance = Maintenance(client.economy, **MAINTENANCE_CONFIG)
+# Who is mid-game, across every cog
+client.sessions = SessionRegistry()
+# Game messages, queued and paced per channel
+client.outbox = Outbox(**OUTBOX_CONFIG)
+
 
 async def load_cogs():
     for filename in os.listdir(COG_FOLDER):
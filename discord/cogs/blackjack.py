@@ -1,16 +1,24 @@
 import io
-import os
-import random
 import asyncio
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import discord
 from discord.ext import commands
 from discord.ui import View, Button
-from modules.card import Card
-from modules.economy import Economy
+from modules.card import BACK_IMAGE, IMAGES, Shoe
+from modules.card_atlas import TableRenderer, table_renderer
+from modules.economy import AsyncEconomy
 from modules.helpers import *
-from PIL import Image
+from modules.outcomes import (
+    DEALER_STANDS_ON,
+    Outcome,
+    hand_value,
+    player_outcome,
+    showdown,
+)
+from modules.render import RenderService, blackjack_table
+from modules.outbox import Outbox
+from modules.sessions import SessionRegistry
 from modules.exceptions import ActiveGameError  # Adjust the import path as necessary
 
 
@@ -44,80 +52,50 @@ class BlackjackView(View):
 class Blackjack(commands.Cog):
     def __init__(self, client: commands.Bot):
         self.client = client
-        self.economy = Economy()
-        self.active_players = set()
+        self.economy: AsyncEconomy = client.economy
+        self.sessions: SessionRegistry = client.sessions
+        self.render: RenderService = client.render
+        self.outbox: Outbox = client.outbox
+        # The atlas is already loaded if the bot did so before forking its
+        # render workers
+        self.tables: TableRenderer = table_renderer()
+        self.decks = BLACKJACK_CONFIG.get("decks", 1)
 
     def cog_check(self, ctx):
-        if ctx.author.id in self.active_players:
+        if self.sessions.is_busy(ctx.author.id):
             raise ActiveGameError("You have an ongoing game. Please finish it first.")
         return True
 
-    def check_bet(
+    async def check_bet(
         self,
         ctx: commands.Context,
         bet: int = DEFAULT_BET,
     ):
+        """Takes the bet from the player's balance for the rest of the hand"""
         bet = int(bet)
         if bet <= 0:
             raise commands.errors.BadArgument()
-        current = self.economy.get_entry(ctx.author.id)[1]
-        if bet > current:
+        entry = await self.economy.settle_bet(
+            ctx.author.id, bet, bet * -1, game="blackjack"
+        )
+        if entry is None:
+            current = (await self.economy.get_entry(ctx.author.id))[1]
             raise InsufficientFundsException(current, bet)
 
-    @staticmethod
-    def hand_to_images(hand: List[Card]) -> List[Image.Image]:
-        return [
-            Image.open(os.path.join(ABS_PATH, "modules/cards/", card.image))
-            for card in hand
-        ]
-
-    @staticmethod
-    def center(*hands: Tuple[Image.Image]) -> Image.Image:
-        """Creates blackjack table with cards placed"""
-        bg: Image.Image = Image.open(os.path.join(ABS_PATH, "modules/", "table.png"))
-        bg_center_x = bg.size[0] // 2
-        bg_center_y = bg.size[1] // 2
-
-        img_w = hands[0][0].size[0]
-        img_h = hands[0][0].size[1]
-
-        start_y = bg_center_y - (((len(hands) * img_h) + ((len(hands) - 1) * 15)) // 2)
-        for hand in hands:
-            start_x = bg_center_x - (
-                ((len(hand) * img_w) + ((len(hand) - 1) * 10)) // 2
-            )
-            for card in hand:
-                bg.alpha_composite(card, (start_x, start_y))
-                start_x += img_w + 10
-            start_y += img_h + 15
-        return bg
-
-    @staticmethod
-    def calc_hand(hand: List[List[Card]]) -> int:
-        """Calculates the sum of the card values and accounts for aces"""
-        non_aces = [c for c in hand if c.symbol != "A"]
-        aces = [c for c in hand if c.symbol == "A"]
-        sum = 0
-        for card in non_aces:
-            if not card.down:
-                if card.symbol in "JQK":
-                    sum += 10
-                else:
-                    sum += card.value
-        for card in aces:
-            if not card.down:
-                if sum <= 10:
-                    sum += 11
-                else:
-                    sum += 1
-        return sum
-
-    def output(self, *hands: Tuple[List[Card]]) -> io.BytesIO:
-        image = self.center(*map(self.hand_to_images, hands))
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format="PNG")
-        img_byte_arr.seek(0)
-        return img_byte_arr
+    async def output(
+        self, dealer: List[int], player: List[int], hole_down: bool
+    ) -> io.BytesIO:
+        images = [[IMAGES[card] for card in hand] for hand in (dealer, player)]
+        if hole_down:
+            images[0][1] = BACK_IMAGE
+        return io.BytesIO(await self.render.run(blackjack_table, images))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def cardatlas(self, ctx: commands.Context):
+        stats = dict(self.tables.atlas.stats(), **self.tables.stats())
+        embed = make_stats_embed("Card atlas, per process", stats)
+        await ctx.reply(embed=embed)
 
     @commands.command(
         aliases=["bj"],
@@ -125,52 +103,41 @@ class Blackjack(commands.Cog):
         usage=f"blackjack [bet- default=${DEFAULT_BET}]",
     )
     async def blackjack(self, ctx: commands.Context, bet: int = DEFAULT_BET):
-        if ctx.author.id in self.active_players:
-            await ctx.send(
-                "You have an ongoing game. Please finish it first.", ephemeral=True
-            )
-            return
-
-        self.active_players.add(ctx.author.id)
+        self.render.check()
+        await self.sessions.start(ctx.author.id, "blackjack", bet)
+        # The bet is held from check_bet on. Whatever is still owed if the
+        # hand is interrupted gets paid out in the finally block.
+        payout = None
 
         try:
-            self.check_bet(ctx, bet)
-            deck = [Card(suit, num) for num in range(2, 15) for suit in Card.suits]
-            random.shuffle(deck)  # Generate deck and shuffle it
-
-            player_hand: List[Card] = []
-            dealer_hand: List[Card] = []
+            await self.check_bet(ctx, bet)
+            payout = bet
+            shoe = Shoe(self.decks)
 
-            player_hand.append(deck.pop())
-            dealer_hand.append(deck.pop())
-            player_hand.append(deck.pop())
-            dealer_hand.append(deck.pop().flip())
-
-            player_score = self.calc_hand(player_hand)
-            dealer_score = self.calc_hand(dealer_hand)
+            player_hand = [shoe.draw()]
+            dealer_hand = [shoe.draw()]
+            player_hand.append(shoe.draw())
+            dealer_hand.append(shoe.draw())
+            # The dealer's second card stays face down until the player stands
+            hole_down = True
 
             async def out_table(**kwargs) -> Tuple[discord.Embed, discord.File]:
                 """Creates an embed and file for the current table"""
-                img_byte_arr = self.output(dealer_hand, player_hand)
+                img_byte_arr = await self.output(dealer_hand, player_hand, hole_down)
                 embed = make_embed(**kwargs)
                 file = discord.File(fp=img_byte_arr, filename="blackjack.png")
                 embed.set_image(url="attachment://blackjack.png")
                 return embed, file
 
-            standing = False
+            outcome: Optional[Outcome] = None
             msg = None
 
             while True:
-                player_score = self.calc_hand(player_hand)
-                dealer_score = self.calc_hand(dealer_hand)
-                if player_score == 21:  # win condition
-                    bet = int(bet * 1.5)
-                    self.economy.add_money(ctx.author.id, bet)
-                    result = ("Blackjack!", "won")
-                    break
-                elif player_score > 21:  # losing condition
-                    self.economy.add_money(ctx.author.id, bet * -1)
-                    result = ("Player busts", "lost")
+                player_score = hand_value(player_hand)
+                dealer_score = hand_value(dealer_hand[:1])
+                # Hitting 21 wins and busting loses straight away
+                outcome = player_outcome(player_score, bet)
+                if outcome:
                     break
 
                 embed, file = await out_table(
@@ -180,11 +147,16 @@ class Blackjack(commands.Cog):
                 )
 
                 view = BlackjackView(self, ctx.author.id)
+                # Prompts wait in the channel behind other games' results
                 if msg:
-                    await msg.edit(embed=embed, attachments=[file], view=view)
+                    await self.outbox.edit(
+                        msg, embed=embed, attachments=[file], view=view
+                    )
                     del file
                 else:
-                    msg = await ctx.reply(file=file, embed=embed, view=view)
+                    msg = await self.outbox.reply(
+                        ctx, final=False, file=file, embed=embed, view=view
+                    )
                     del file
 
                 try:
@@ -195,63 +167,61 @@ class Blackjack(commands.Cog):
                     view.value = "stand"  # Automatically stand after timeout
 
                 if view.value == "hit":
-                    player_hand.append(deck.pop())
+                    player_hand.append(shoe.draw())
                     continue
                 elif view.value == "stand":
-                    standing = True
                     break
 
-            if standing:
-                dealer_hand[1].flip()
-                player_score = self.calc_hand(player_hand)
-                dealer_score = self.calc_hand(dealer_hand)
+            if outcome is None:
+                hole_down = False
+                dealer_score = hand_value(dealer_hand)
 
-                while dealer_score < 17:  # dealer draws until 17 or greater
-                    dealer_hand.append(deck.pop())
-                    dealer_score = self.calc_hand(dealer_hand)
+                while dealer_score < DEALER_STANDS_ON:
+                    dealer_hand.append(shoe.draw())
+                    dealer_score = hand_value(dealer_hand)
 
-                if dealer_score == 21:  # winning/losing conditions
-                    self.economy.add_money(ctx.author.id, bet * -1)
-                    result = ("Dealer blackjack", "lost")
-                elif dealer_score > 21:
-                    self.economy.add_money(ctx.author.id, bet)
-                    result = ("Dealer busts", "won")
-                elif dealer_score == player_score:
-                    result = ("Tie!", "kept")
-                elif dealer_score > player_score:
-                    self.economy.add_money(ctx.author.id, bet * -1)
-                    result = ("You lose!", "lost")
-                elif dealer_score < player_score:
-                    self.economy.add_money(ctx.author.id, bet)
-                    result = ("You win!", "won")
+                outcome = showdown(player_score, dealer_score, bet)
+            payout = outcome.payout
 
             color = (
                 discord.Color.red()
-                if result[1] == "lost"
+                if outcome.verb == "lost"
                 else (
                     discord.Color.green()
-                    if result[1] == "won"
+                    if outcome.verb == "won"
                     else discord.Color.blue()
                 )
             )
 
+            if payout:
+                await self.economy.add_money(
+                    ctx.author.id, payout, game="blackjack", reason="payout"
+                )
+            payout = None
+
             embed, file = await out_table(
-                title=result[0],
+                title=outcome.title,
                 color=color,
                 description=(
-                    f"**You {result[1]} ${bet}**\nYour hand: {player_score}\n"
-                    + f"Dealer's hand: {dealer_score}"
+                    f"**You {outcome.verb} ${outcome.amount}**\n"
+                    f"Your hand: {player_score}\n" + f"Dealer's hand: {dealer_score}"
                 ),
             )
             if msg:
-                await msg.edit(embed=embed, attachments=[file], view=None)
+                await self.outbox.edit(
+                    msg, final=True, embed=embed, attachments=[file], view=None
+                )
                 del file
             else:
-                await ctx.reply(file=file, embed=embed)
+                await self.outbox.reply(ctx, file=file, embed=embed)
                 del file
 
         finally:
-            self.active_players.remove(ctx.author.id)
+            if payout:
+                await self.economy.add_money(
+                    ctx.author.id, payout, game="blackjack", reason="payout"
+                )
+            self.sessions.end(ctx.author.id)
 
 
 async def setup(client: commands.Bot):
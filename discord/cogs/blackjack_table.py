@@ -0,0 +1,387 @@
+import asyncio
+import io
+from typing import Dict, List, Optional
+
+import discord
+from discord.ext import commands
+from discord.ui import View, Button
+from modules.card import BACK_IMAGE, IMAGES, LABELS, Shoe
+from modules.economy import AsyncEconomy
+from modules.helpers import *
+from modules.outcomes import (
+    DEALER_STANDS_ON,
+    Outcome,
+    hand_value,
+    player_outcome,
+    showdown,
+)
+from modules.render import RenderService, blackjack_table
+from modules.outbox import Outbox
+from modules.sessions import SessionRegistry
+from modules.exceptions import ActiveGameError
+
+
+class Seat:
+    """One player at a table and their hand"""
+
+    def __init__(self, user: discord.abc.User):
+        self.user = user
+        self.hand: List[int] = []
+        self.outcome: Optional[Outcome] = None
+
+
+class Table:
+    """A channel's blackjack table: who is seated, the shoe and the dealer.
+
+    Everyone at the table plays the same bet against one dealer hand."""
+
+    def __init__(self, host: discord.abc.User, bet: int, decks: int = 1):
+        self.host = host
+        self.bet = bet
+        self.shoe = Shoe(decks)
+        self.seats: Dict[int, Seat] = {}
+        self.dealer: List[int] = []
+        self.hole_down = True
+        # Set once the join window closes
+        self.dealing = False
+        self.turn: Optional[Seat] = None
+        # None until the table's message has gone out
+        self.message: Optional[discord.Message] = None
+        # The Join/Deal buttons, while the join window is open
+        self.join: Optional["JoinView"] = None
+
+    def deal(self) -> None:
+        """Two cards each, one at a time, the dealer's second face down"""
+        for _ in range(2):
+            for seat in self.seats.values():
+                seat.hand.append(self.shoe.draw())
+            self.dealer.append(self.shoe.draw())
+
+    def play_dealer(self) -> int:
+        """Reveals the hole card and draws to DEALER_STANDS_ON"""
+        self.hole_down = False
+        while hand_value(self.dealer) < DEALER_STANDS_ON:
+            self.dealer.append(self.shoe.draw())
+        return hand_value(self.dealer)
+
+    def images(self) -> List[List[str]]:
+        """Card image names of every hand, dealer first"""
+        dealer = [IMAGES[card] for card in self.dealer]
+        if self.hole_down:
+            dealer[1] = BACK_IMAGE
+        return [dealer] + [
+            [IMAGES[card] for card in seat.hand] for seat in self.seats.values()
+        ]
+
+    def embed(self, title: str, description: str = None) -> discord.Embed:
+        embed = make_embed(
+            title=title,
+            description=description or f"Bet: ${self.bet} a hand",
+            color=discord.Color.dark_green(),
+        )
+        if self.dealer:
+            shown = self.dealer[:1] if self.hole_down else self.dealer
+            cards = " ".join(LABELS[card] for card in shown)
+            if self.hole_down:
+                cards += " ??"
+            embed.add_field(
+                name="Dealer", value=f"{cards} ({hand_value(shown)})", inline=False
+            )
+        for seat in self.seats.values():
+            if seat.hand:
+                value = (
+                    " ".join(LABELS[card] for card in seat.hand)
+                    + f" ({hand_value(seat.hand)})"
+                )
+            else:
+                value = "Waiting for the deal"
+            if seat.outcome:
+                title, verb, amount, _ = seat.outcome
+                value += f"\n**{title}** You {verb} ${amount}"
+            elif seat is self.turn:
+                value += "\nTo play"
+            embed.add_field(name=seat.user.display_name, value=value, inline=False)
+        return embed
+
+
+class JoinView(View):
+    def __init__(self, cog: "BlackjackTables", table: Table):
+        super().__init__(timeout=None)
+        self.cog = cog
+        self.table = table
+        # The press that closed the window, answered with the deal
+        self.interaction: Optional[discord.Interaction] = None
+
+    @discord.ui.button(label="Join", style=discord.ButtonStyle.primary)
+    async def join(self, interaction: discord.Interaction, button: Button):
+        refused = await self.cog.sit(self.table, interaction.user)
+        if refused:
+            await interaction.response.send_message(refused, ephemeral=True)
+            return
+        if len(self.table.seats) >= self.cog.seats:
+            self.interaction = interaction
+            self.stop()
+            return
+        self.cog.outbox.discard(self.table.message)
+        await interaction.response.edit_message(embed=self.cog.joining(self.table))
+
+    @discord.ui.button(label="Deal", style=discord.ButtonStyle.secondary)
+    async def deal(self, interaction: discord.Interaction, button: Button):
+        if interaction.user.id != self.table.host.id:
+            await interaction.response.send_message(
+                "Only the player who opened the table can deal.", ephemeral=True
+            )
+            return
+        self.interaction = interaction
+        self.stop()
+
+
+class TurnView(View):
+    def __init__(self, user_id: int):
+        super().__init__(timeout=None)
+        self.user_id = user_id
+        self.value = None
+        # Answered with the next update of the table
+        self.interaction: Optional[discord.Interaction] = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message(
+                "It isn't your turn.", ephemeral=True
+            )
+            return False
+        return True
+
+    @discord.ui.button(label="Hit", style=discord.ButtonStyle.primary, emoji="🇭")
+    async def hit(self, interaction: discord.Interaction, button: Button):
+        self.value = "hit"
+        self.interaction = interaction
+        self.stop()
+
+    @discord.ui.button(label="Stand", style=discord.ButtonStyle.secondary, emoji="🇸")
+    async def stand(self, interaction: discord.Interaction, button: Button):
+        self.value = "stand"
+        self.interaction = interaction
+        self.stop()
+
+
+class BlackjackTables(commands.Cog, name="Blackjack Tables"):
+    """Blackjack for up to ``seats`` players in a channel against one dealer.
+
+    The players take their turns on one message. Turns only update its
+    text, each through the button press that prompted it, so a move
+    costs one Discord call and no rendering. Bets are taken and paid out
+    in one batch per round, and the table is drawn once, at the end."""
+
+    def __init__(self, client: commands.Bot):
+        self.client = client
+        self.economy: AsyncEconomy = client.economy
+        self.sessions: SessionRegistry = client.sessions
+        self.render: RenderService = client.render
+        self.outbox: Outbox = client.outbox
+        self.decks = BLACKJACK_CONFIG.get("decks", 1)
+        self.seats = BLACKJACK_CONFIG.get("seats", 7)
+        self.join_seconds = BLACKJACK_CONFIG.get("join_seconds", 20)
+        self.turn_seconds = BLACKJACK_CONFIG.get("turn_seconds", 30)
+        # Open tables by channel
+        self.tables: Dict[int, Table] = {}
+
+    def cog_check(self, ctx):
+        if self.sessions.is_busy(ctx.author.id):
+            raise ActiveGameError("You have an ongoing game. Please finish it first.")
+        return True
+
+    async def sit(self, table: Table, user: discord.abc.User) -> Optional[str]:
+        """Seats the user at the table, or says why they can't sit"""
+        if user.id in table.seats:
+            return "You're already at this table."
+        if table.dealing:
+            return "The cards are already out. Join the next round."
+        if len(table.seats) >= self.seats:
+            return "This table is full."
+        if self.sessions.is_busy(user.id):
+            return "You have an ongoing game. Please finish it first."
+        await self.sessions.start(user.id, "blackjack", table.bet)
+        table.seats[user.id] = Seat(user)
+        return None
+
+    def joining(self, table: Table) -> discord.Embed:
+        return table.embed(
+            "Blackjack table",
+            f"Bet: ${table.bet} a hand. Join within {self.join_seconds} "
+            f"seconds, up to {self.seats} players. {table.host.display_name} "
+            "can deal sooner.",
+        )
+
+    async def update(
+        self,
+        table: Table,
+        interaction: Optional[discord.Interaction],
+        final: bool = False,
+        **kwargs,
+    ) -> None:
+        """Edits the table's message, as the reply to the button press that
+        led to the change if there is one, so it takes a single call.
+        Otherwise the edit goes through the channel's outbox."""
+        if interaction and not interaction.response.is_done():
+            # Whatever edit was still queued is out of date now
+            self.outbox.discard(table.message)
+            await interaction.response.edit_message(**kwargs)
+        else:
+            await self.outbox.edit(table.message, final=final, **kwargs)
+
+    @commands.command(
+        aliases=["bjt"],
+        brief=(
+            "Open a blackjack table in this channel, or join the open one.\n"
+            "Bet must be greater than $0"
+        ),
+        usage=f"table [bet- default=${DEFAULT_BET}]",
+    )
+    async def table(self, ctx: commands.Context, bet: int = DEFAULT_BET):
+        table = self.tables.get(ctx.channel.id)
+        if table:
+            refused = await self.sit(table, ctx.author)
+            if refused:
+                await self.outbox.reply(ctx, content=refused)
+            elif len(table.seats) >= self.seats:
+                # The last seat deals the cards, as it does from the Join button
+                if table.join:
+                    table.join.stop()
+            elif table.message:
+                # Not waited for, so players joining at once share one edit
+                self.outbox.edit(table.message, embed=self.joining(table))
+            # Otherwise play() shows the seat once the message is out
+            return
+
+        if bet <= 0:
+            raise commands.errors.BadArgument()
+        self.render.check()
+        table = self.tables[ctx.channel.id] = Table(ctx.author, bet, self.decks)
+        try:
+            await self.sit(table, ctx.author)
+            await self.play(ctx, table)
+        finally:
+            del self.tables[ctx.channel.id]
+            for user_id in table.seats:
+                self.sessions.end(user_id)
+
+    async def play(self, ctx: commands.Context, table: Table):
+        view = table.join = JoinView(self, table)
+        shown = len(table.seats)
+        table.message = await self.outbox.reply(
+            ctx, final=False, embed=self.joining(table), view=view
+        )
+        if len(table.seats) != shown and not view.is_finished():
+            # Players sat down while the message was waiting to go out
+            self.outbox.edit(table.message, embed=self.joining(table))
+        try:
+            await asyncio.wait_for(view.wait(), timeout=self.join_seconds)
+        except asyncio.TimeoutError:
+            view.stop()
+        interaction = view.interaction
+        table.dealing = True
+        table.join = None
+
+        # Every bet in one batch. Whoever can't cover it is stood up.
+        seats = list(table.seats.values())
+        taken = await self.economy.transfer_many(
+            [[(seat.user.id, -table.bet, 0, 0)] for seat in seats],
+            game="blackjack",
+            reason="bet",
+        )
+        broke = [seat for seat, entries in zip(seats, taken) if entries is None]
+        for seat in broke:
+            del table.seats[seat.user.id]
+            self.sessions.end(seat.user.id)
+        note = "".join(
+            f"\n{seat.user.display_name} can't cover the bet." for seat in broke
+        )
+        if not table.seats:
+            await self.update(
+                table,
+                interaction,
+                final=True,
+                embed=table.embed("Blackjack table", "Nobody could cover the bet."),
+                view=None,
+            )
+            return
+
+        # Whatever is still owed if the round is cut short is paid back below
+        owed = {user_id: table.bet for user_id in table.seats}
+        try:
+            table.deal()
+            for seat in table.seats.values():
+                table.turn = seat
+                while True:
+                    # Hitting 21 wins and busting loses straight away
+                    seat.outcome = player_outcome(hand_value(seat.hand), table.bet)
+                    if seat.outcome:
+                        break
+                    turn = TurnView(seat.user.id)
+                    await self.update(
+                        table,
+                        interaction,
+                        embed=table.embed(
+                            f"{seat.user.display_name}'s turn",
+                            f"Bet: ${table.bet} a hand{note}",
+                        ),
+                        view=turn,
+                    )
+                    try:
+                        await asyncio.wait_for(turn.wait(), timeout=self.turn_seconds)
+                    except asyncio.TimeoutError:
+                        turn.stop()  # Stands after the timeout
+                    interaction = turn.interaction
+                    if turn.value != "hit":
+                        break
+                    seat.hand.append(table.shoe.draw())
+            table.turn = None
+
+            if any(seat.outcome is None for seat in table.seats.values()):
+                dealer_score = table.play_dealer()
+            else:
+                table.hole_down = False
+                dealer_score = hand_value(table.dealer)
+            for seat in table.seats.values():
+                if seat.outcome is None:
+                    seat.outcome = showdown(
+                        hand_value(seat.hand), dealer_score, table.bet
+                    )
+
+            await self.economy.transfer_many(
+                [
+                    [(seat.user.id, seat.outcome.payout, 0, 0)]
+                    for seat in table.seats.values()
+                    if seat.outcome.payout
+                ],
+                game="blackjack",
+                reason="payout",
+            )
+            owed = {}
+
+            # Rendering can outlast the 3 seconds a press has to be answered in
+            if interaction and not interaction.response.is_done():
+                await interaction.response.defer()
+            img_byte_arr = io.BytesIO(
+                await self.render.run(blackjack_table, table.images())
+            )
+            embed = table.embed("Round over", f"Bet: ${table.bet} a hand{note}")
+            file = discord.File(fp=img_byte_arr, filename="blackjack.png")
+            embed.set_image(url="attachment://blackjack.png")
+            await self.outbox.edit(
+                table.message, final=True, embed=embed, attachments=[file], view=None
+            )
+            del file
+
+        finally:
+            if owed:
+                await self.economy.transfer_many(
+                    [[(user_id, bet, 0, 0)] for user_id, bet in owed.items()],
+                    game="blackjack",
+                    reason="payout",
+                )
+
+
+async def setup(client: commands.Bot):
+    await client.add_cog(BlackjackTables(client))
@@ -1,79 +1,80 @@
-import random
 import os
 
 import discord
 from discord.ext import commands
 from discord.ext.commands.errors import BadArgument
-from modules.economy import Economy
+from modules.economy import AsyncEconomy, Entry
 from modules.helpers import (
     DEFAULT_BET,
     InsufficientFundsException,
     make_embed,
     ABS_PATH,
 )
+from modules.outbox import Outbox
+from modules.outcomes import COIN, flip_coin, flip_delta, roll_delta, roll_die
 
 
 class Gambling(commands.Cog):
     def __init__(self, client: commands.Bot):
         self.client = client
-        self.economy = Economy()
+        self.economy: AsyncEconomy = client.economy
+        self.outbox: Outbox = client.outbox
 
-    def check_bet(
-        self,
-        ctx: commands.Context,
-        bet: int = DEFAULT_BET,
-    ):
+    def check_bet(self, bet: int = DEFAULT_BET):
         bet = int(bet)
         if bet <= 0:
             raise commands.errors.BadArgument()
-        current = self.economy.get_entry(ctx.author.id)[1]
-        if bet > current:
+
+    async def settle_bet(self, ctx: commands.Context, bet: int, delta: int) -> Entry:
+        """Checks the bet against the balance and pays it out atomically"""
+        entry = await self.economy.settle_bet(
+            ctx.author.id, bet, delta, game=ctx.command.name
+        )
+        if entry is None:
+            current = (await self.economy.get_entry(ctx.author.id))[1]
             raise InsufficientFundsException(current, bet)
+        return entry
 
     @commands.command(
         brief="Flip a coin\nBet must be greater than $0",
         usage=f"flip [heads|tails] *[bet- default=${DEFAULT_BET}]",
     )
     async def flip(self, ctx: commands.Context, choice: str, bet: int = DEFAULT_BET):
-        self.check_bet(ctx, bet)
-        choices = {"h": "Heads", "t": "Tails"}
+        self.check_bet(bet)
         choice = choice.lower()[0]
-        if choice in choices.keys():
-            result = random.choice(list(choices.keys()))
-            won = result == choice
+        if choice in COIN:
+            result = flip_coin()
+            delta = flip_delta(choice, result, bet)
 
-            if won:
-                self.economy.add_money(ctx.author.id, bet)
+            if delta > 0:
                 color = discord.Color.green()
                 title = "You Won!"
-                description = (
-                    f"The coin landed on **{choices[result]}**!\nYou won ${bet}."
-                )
+                description = f"The coin landed on **{COIN[result]}**!\nYou won ${bet}."
             else:
-                self.economy.add_money(ctx.author.id, bet * -1)
                 color = discord.Color.red()
                 title = "You Lost..."
                 description = (
-                    f"The coin landed on **{choices[result]}**.\nYou lost ${bet}."
+                    f"The coin landed on **{COIN[result]}**.\nYou lost ${bet}."
                 )
 
+            entry = await self.settle_bet(ctx, bet, delta)
             embed = make_embed(title=title, description=description, color=color)
-            embed.add_field(name="Your Choice", value=choices[choice], inline=True)
-            embed.add_field(name="Result", value=choices[result], inline=True)
+            embed.add_field(name="Your Choice", value=COIN[choice], inline=True)
+            embed.add_field(name="Result", value=COIN[result], inline=True)
             embed.add_field(
                 name="New Balance",
-                value=f"${self.economy.get_entry(ctx.author.id)[1]}",
+                value=f"${entry[1]}",
                 inline=False,
             )
 
             # Add the coin image to the embed
             image_path = os.path.join(
-                ABS_PATH, "modules", "ht", f"{choices[result].lower()}.png"
+                ABS_PATH, "modules", "ht", f"{COIN[result].lower()}.png"
             )
-            file = discord.File(image_path, filename=f"{choices[result].lower()}.png")
-            embed.set_image(url=f"attachment://{choices[result].lower()}.png")
+            file = discord.File(image_path, filename=f"{COIN[result].lower()}.png")
+            embed.set_image(url=f"attachment://{COIN[result].lower()}.png")
 
-            await ctx.reply(embed=embed, file=file)
+            await self.outbox.reply(ctx, embed=embed, file=file)
         else:
             raise BadArgument()
 
@@ -82,33 +83,32 @@ class Gambling(commands.Cog):
         usage=f"roll [guess:1-6] [bet- default=${DEFAULT_BET}]",
     )
     async def roll(self, ctx: commands.Context, choice: int, bet: int = DEFAULT_BET):
-        self.check_bet(ctx, bet)
+        self.check_bet(bet)
         choices = range(1, 7)
         if choice in choices:
-            result = random.choice(choices)
-            won = result == choice
+            result = roll_die()
+            delta = roll_delta(choice, result, bet)
 
-            if won:
-                self.economy.add_money(ctx.author.id, bet * 6)
+            if delta > 0:
                 color = discord.Color.green()
                 title = "You Won!"
-                description = f"The die landed on **{result}**!\nYou won ${bet * 6}."
+                description = f"The die landed on **{result}**!\nYou won ${delta}."
             else:
-                self.economy.add_money(ctx.author.id, bet * -1)
                 color = discord.Color.red()
                 title = "You Lost..."
                 description = f"The die landed on **{result}**.\nYou lost ${bet}."
 
+            entry = await self.settle_bet(ctx, bet, delta)
             embed = make_embed(title=title, description=description, color=color)
             embed.add_field(name="Your Choice", value=choice, inline=True)
             embed.add_field(name="Result", value=result, inline=True)
             embed.add_field(
                 name="New Balance",
-                value=f"${self.economy.get_entry(ctx.author.id)[1]}",
+                value=f"${entry[1]}",
                 inline=False,
             )
 
-            await ctx.reply(embed=embed)
+            await self.outbox.reply(ctx, embed=embed)
         else:
             raise BadArgument()
 
@@ -1,13 +1,16 @@
+import time
+
 import discord
 from discord.ext import commands
-from modules.economy import Economy
+from modules.bulk import Progress, read_entries
+from modules.economy import AsyncEconomy
 from modules.helpers import *
 
 
 class GamblingHelpers(commands.Cog, name="General"):
     def __init__(self, client: commands.Bot) -> None:
         self.client = client
-        self.economy = Economy()
+        self.economy: AsyncEconomy = client.economy
 
     @commands.command(hidden=True)
     @commands.is_owner()
@@ -19,9 +22,91 @@ class GamblingHelpers(commands.Cog, name="General"):
         credits: int = 0,
     ):
         if money:
-            self.economy.set_money(user_id, money)
+            await self.economy.set_money(user_id, money)
         if credits:
-            self.economy.set_credits(user_id, credits)
+            await self.economy.set_credits(user_id, credits)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def payout(
+        self, ctx: commands.Context, amount: int, *members: discord.Member
+    ):
+        # One transfer per member so a short balance only skips that member
+        results = await self.economy.transfer_many(
+            [[(member.id, amount, 0, 0)] for member in members], reason="payout"
+        )
+        paid = sum(entries is not None for entries in results)
+        await ctx.reply(f"Paid ${amount:,} to {paid}/{len(members)} members")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def export(self, ctx: commands.Context, path: str):
+        rows = await self.economy.export_entries(path)
+        await ctx.reply(f"Exported {rows:,} accounts to {path}")
+
+    @commands.command(name="import", hidden=True)
+    @commands.is_owner()
+    async def import_(self, ctx: commands.Context, path: str):
+        message = await ctx.reply(f"Importing {path}...")
+        progress = Progress(every=5)
+
+        def report(rows: int):
+            # Edits are rate limited, so only every few seconds
+            if text := progress(rows):
+                self.client.loop.create_task(message.edit(content=text))
+
+        rows = await self.economy.import_entries(read_entries(path), progress=report)
+        await message.edit(content=f"Imported {progress(rows, done=True)}")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def sessions(self, ctx: commands.Context):
+        now = time.time()
+        lines = [
+            f"<@{session.user_id}> {session.game}, bet {session.bet:,}, "
+            f"{now - session.started:.0f}s"
+            for session in self.client.sessions.all()
+        ]
+        embed = make_embed(
+            title=f"Live sessions ({len(lines)})",
+            description="\n".join(lines[:25]) or "Nobody is playing.",
+            footer=None,
+        )
+        await ctx.reply(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def dbstats(self, ctx: commands.Context):
+        embed = make_stats_embed("Economy database", self.economy.stats())
+        await ctx.reply(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def renderstats(self, ctx: commands.Context):
+        embed = make_stats_embed("Image rendering", self.client.render.stats())
+        await ctx.reply(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def outboxstats(self, ctx: commands.Context):
+        embed = make_stats_embed("Outgoing messages", self.client.outbox.stats())
+        await ctx.reply(embed=embed)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def audit(self, ctx: commands.Context):
+        mismatches = await self.economy.audit(limit=10)
+        lines = [
+            f"<@{user_id}> ${money:,} (expected ${expected_money:,}), "
+            f"{credits:,} credits (expected {expected_credits:,})"
+            for user_id, expected_money, money, expected_credits, credits in mismatches
+        ]
+        embed = make_embed(
+            title="Ledger audit",
+            description="\n".join(lines) or "Every balance matches the ledger.",
+            color=discord.Color.red() if lines else discord.Color.green(),
+        )
+        await ctx.reply(embed=embed)
 
     @commands.command(
         brief=f"Gives you ${DEFAULT_BET*B_MULT} once every {B_COOLDOWN}hrs",
@@ -31,7 +116,7 @@ class GamblingHelpers(commands.Cog, name="General"):
     @commands.cooldown(1, B_COOLDOWN * 3600, type=commands.BucketType.user)
     async def work(self, ctx: commands.Context):
         amount = DEFAULT_BET * B_MULT
-        self.economy.add_money(ctx.author.id, amount)
+        await self.economy.add_money(ctx.author.id, amount, reason="work")
         await ctx.reply(f"Added ${amount} come back in {B_COOLDOWN}hrs")
 
     @commands.command(
@@ -43,7 +128,7 @@ class GamblingHelpers(commands.Cog, name="General"):
         user_id = user.id if user else ctx.author.id
         user = self.client.get_user(user_id) or await self.client.fetch_user(user_id)
 
-        profile = self.economy.get_entry(user.id)
+        profile = await self.economy.get_entry(user.id)
         embed = make_embed(
             title=user.name,
             description=(
@@ -60,7 +145,7 @@ class GamblingHelpers(commands.Cog, name="General"):
         aliases=["top", "lb"],
     )
     async def leaderboard(self, ctx: commands.Context):
-        entries = self.economy.top_entries(5)
+        entries = await self.economy.top_entries(5)
         embed = make_embed(title="Leaderboard:", color=discord.Color.gold())
         for i, entry in enumerate(entries):
             user = self.client.get_user(entry[0]) or await self.client.fetch_user(
@@ -98,8 +183,11 @@ class GamblingHelpers(commands.Cog, name="General"):
             await ctx.reply(embed=embed)
             return
 
-        giver_profile = self.economy.get_entry(giver_id)
-        if giver_profile[1] < amount:
+        # Both sides change together, or not at all if the giver is short
+        entries = await self.economy.transfer(
+            [(giver_id, -amount, 0, 0), (receiver_id, amount, 0, 0)], reason="give"
+        )
+        if entries is None:
             embed = make_embed(
                 title="Error",
                 description="You do not have enough money to give.",
@@ -108,9 +196,6 @@ class GamblingHelpers(commands.Cog, name="General"):
             await ctx.reply(embed=embed)
             return
 
-        self.economy.add_money(giver_id, -amount)
-        self.economy.add_money(receiver_id, amount)
-
         embed = make_embed(
             title="Success",
             description=f"Gave ${amount:,} to {user.mention}.",
@@ -121,10 +206,10 @@ class GamblingHelpers(commands.Cog, name="General"):
     @commands.command(brief="Sell a kidney for $10,000", usage="sellk", aliases=["sk"])
     async def sellk(self, ctx: commands.Context):
         user_id = ctx.author.id
-        entry = self.economy.get_entry(user_id)
+        entry = await self.economy.get_entry(user_id)
 
         if entry[3] > 0:
-            new_entry = self.economy.remove_kidney(user_id)
+            new_entry = await self.economy.remove_kidney(user_id)
             kidneys_left = new_entry[3]
             money = new_entry[1]
 
@@ -152,7 +237,7 @@ class GamblingHelpers(commands.Cog, name="General"):
     )
     async def kidneys(self, ctx: commands.Context):
         user_id = ctx.author.id
-        entry = self.economy.get_entry(user_id)
+        entry = await self.economy.get_entry(user_id)
         kidneys_left = entry[3]
 
         if kidneys_left == 2:
@@ -2,7 +2,10 @@ import discord
 from discord.ext import commands
 from discord.ext.commands.errors import *
 from modules.helpers import PREFIX, InsufficientFundsException
-from modules.exceptions import ActiveGameError  # Adjust the import path as necessary
+from modules.exceptions import (  # Adjust the import path as necessary
+    ActiveGameError,
+    RenderQueueFull,
+)
 
 
 class Handlers(commands.Cog, name="handlers"):
@@ -65,6 +68,9 @@ class Handlers(commands.Cog, name="handlers"):
         elif isinstance(error, ActiveGameError):
             return
 
+        elif isinstance(error, RenderQueueFull):
+            await ctx.reply(str(error))
+
         else:
             raise error
 
@@ -54,8 +54,8 @@ class Help(commands.Cog, name="help"):
     @commands.command(hidden=True)
     @commands.is_owner()
     async def kill(self, ctx: commands.Context):
-        self.client.remove_cog("handlers")
-        await self.client.logout()
+        await self.client.remove_cog("handlers")
+        await self.client.close()
 
 
 async def setup(client):
@@ -1,16 +1,18 @@
 import asyncio
-import bisect
-import os
-import random
 import io
+from typing import Optional
 
 import discord
 from discord.ext import commands
 from discord.ui import View, Button
-from modules.economy import Economy
+from modules.economy import AsyncEconomy, Entry
 from modules.helpers import *
-from PIL import Image
+from modules.outbox import Outbox
+from modules.sessions import SessionRegistry
+from modules.render import RenderService
+from modules.slot_machine import Animation, SlotMachine, Stops, render_spin
 from modules.exceptions import ActiveGameError
+from modules.outcomes import SLOT_SYMBOL_WEIGHTS, slot_reward, slot_stops
 
 
 class SlotView(View):
@@ -27,7 +29,7 @@ class SlotView(View):
         # Disable the button when the view times out
         for item in self.children:
             item.disabled = True
-        await self.message.edit(view=self)
+        self.game.outbox.edit(self.message, view=self)
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
         if interaction.user.id != self.user_id:
@@ -51,23 +53,75 @@ class SlotView(View):
 class Slots(commands.Cog):
     def __init__(self, client: commands.Bot):
         self.client = client
-        self.economy = Economy()
-        self.active_players = set()
+        self.economy: AsyncEconomy = client.economy
+        self.sessions: SessionRegistry = client.sessions
+        self.render: RenderService = client.render
+        self.outbox: Outbox = client.outbox
+        # Decoded and scaled once, then shared by every spin
+        self.machine = SlotMachine(
+            cache_mb=SLOTS_CONFIG.get("cache_mb", 32),
+            spinning_format=SLOTS_CONFIG.get("format", "gif"),
+            result_format=SLOTS_CONFIG.get("result_format", "png"),
+        )
+        self.warming: Optional[asyncio.Task] = None
+
+    async def cog_load(self):
+        if SLOTS_CONFIG.get("prewarm", True):
+            self.warming = asyncio.create_task(self.warm_cache())
+
+    async def cog_unload(self):
+        if self.warming:
+            self.warming.cancel()
+
+    async def warm_cache(self):
+        """Renders winning spins into the cache, likeliest first, until
+        it is full"""
+        chances = [
+            high - low
+            for low, high in zip([0, *SLOT_SYMBOL_WEIGHTS], [*SLOT_SYMBOL_WEIGHTS, 100])
+        ]
+        # One job at a time, leaving the other workers free for live spins
+        for stops in self.machine.warm_order(chances):
+            if stops in self.machine.cache:
+                continue
+            animation = await self.render_animation(stops)
+            if not self.machine.cache.put(stops, animation, evict=False):
+                break
+
+    async def render_animation(self, stops: Stops) -> Animation:
+        return await self.render.run(
+            render_spin,
+            stops,
+            self.machine.spinning_format,
+            self.machine.result_format,
+        )
+
+    async def animation(self, stops: Stops) -> Animation:
+        animation = self.machine.cache.get(stops)
+        if animation is None:
+            animation = await self.render_animation(stops)
+            self.machine.cache.put(stops, animation)
+        return animation
 
     def cog_check(self, ctx):
-        if ctx.author.id in self.active_players:
+        if self.sessions.is_busy(ctx.author.id):
             raise ActiveGameError("You have an ongoing game. Please finish it first.")
         return True
 
     def check_bet(self, ctx: commands.Context, bet: int = DEFAULT_BET):
         bet = int(bet)
         if bet <= 0 or bet > 3:
-            self.active_players.remove(ctx.author.id)
             raise commands.errors.BadArgument()
-        current = self.economy.get_entry(ctx.author.id)[2]
-        if bet > current:
-            self.active_players.remove(ctx.author.id)
+
+    async def settle_bet(self, ctx: commands.Context, bet: int, delta: int) -> Entry:
+        """Checks the bet against the credits and pays it out atomically"""
+        entry = await self.economy.settle_bet(
+            ctx.author.id, bet, delta, "credits", game="slots"
+        )
+        if entry is None:
+            current = (await self.economy.get_entry(ctx.author.id))[2]
             raise InsufficientFundsException(current, bet)
+        return entry
 
     @commands.command(
         brief="Slot machine\nbet must be 1-3",
@@ -75,84 +129,32 @@ class Slots(commands.Cog):
         aliases=["sl"],
     )
     async def slots(self, ctx: commands.Context, bet: int = 1):
-        if ctx.author.id in self.active_players:
-            await ctx.send(
-                "You have an ongoing game. Please finish it first.", ephemeral=True
-            )
-            return
-
-        self.active_players.add(ctx.author.id)
+        self.render.check()
 
         async def play_slots(bet):
             self.check_bet(ctx, bet=bet)
-            path = os.path.join(ABS_PATH, "modules/")
-            facade = Image.open(f"{path}slot-face.png").convert("RGBA")
-            reel = Image.open(f"{path}slot-reel.png").convert("RGBA")
-
-            facade = facade.resize(
-                (facade.width // 2, facade.height // 2), Image.LANCZOS
-            )
-            reel = reel.resize((reel.width // 2, reel.height // 2), Image.LANCZOS)
-
-            rw, rh = reel.size
-            item = 180
-            items = rh // item
-
-            s1 = random.randint(1, items - 1)
-            s2 = random.randint(1, items - 1)
-            s3 = random.randint(1, items - 1)
-
-            win_rate = 12 / 100
-
-            if random.random() < win_rate:
-                symbols_weights = [3.5, 7, 15, 25, 55]
-                x = round(random.random() * 100, 1)
-                pos = bisect.bisect(symbols_weights, x)
-                s1 = pos + (random.randint(1, (items / 6) - 1) * 6)
-                s2 = pos + (random.randint(1, (items / 6) - 1) * 6)
-                s3 = pos + (random.randint(1, (items / 6) - 1) * 6)
-                s1 = s1 - 6 if s1 == items else s1
-                s2 = s2 - 6 if s2 == items else s2
-                s3 = s3 - 6 if s3 == items else s3
-
-            images = []
-            speed = 30
-            for i in range(1, (item // speed) + 1):
-                bg = Image.new("RGBA", facade.size, color=(255, 255, 255))
-                bg.paste(reel, (25 + rw * 0, 100 - (speed * i * s1)))
-                bg.paste(reel, (25 + rw * 1, 100 - (speed * i * s2)))
-                bg.paste(reel, (25 + rw * 2, 100 - (speed * i * s3)))
-                bg.alpha_composite(facade)
-                images.append(bg)
-
-            spinning_images = images[:-1]
-            spinning_file = self.create_optimized_gif(
-                spinning_images, duration=430, loop=True
-            )
-
-            result_image = images[-1]
-            result_file = self.create_optimized_gif(
-                [result_image], duration=1000, loop=False
-            )
+            s1, s2, s3 = slot_stops(self.machine.items)
 
             result = ("lost", bet)
-            self.economy.add_credits(ctx.author.id, bet * -1)
-            if (1 + s1) % 6 == (1 + s2) % 6 == (1 + s3) % 6:
-                symbol = (1 + s1) % 6
-                reward = [4, 80, 40, 25, 10, 5][symbol] * bet
+            delta = bet * -1
+            reward = slot_reward((s1, s2, s3), bet)
+            if reward:
                 result = ("won", reward)
-                self.economy.add_credits(ctx.author.id, reward)
+                delta += reward
+            entry = await self.settle_bet(ctx, bet, delta)
+
+            animation = await self.animation((s1, s2, s3))
+            spinning_file = self.attachment(
+                animation.spinning, self.machine.spinning_name
+            )
+            result_file = self.attachment(animation.result, self.machine.result_name)
 
             result_embed = make_embed(
                 title=(
                     f"You {result[0]} {result[1]} credits"
                     + ("." if result[0] == "lost" else "!")
                 ),
-                description=(
-                    "You now have "
-                    + f"**{self.economy.get_entry(ctx.author.id)[2]}** "
-                    + "credits."
-                ),
+                description=("You now have " + f"**{entry[2]}** " + "credits."),
                 color=(
                     discord.Color.red()
                     if result[0] == "lost"
@@ -160,71 +162,80 @@ class Slots(commands.Cog):
                 ),
             )
 
-            result_embed.set_image(url="attachment://slot_result.gif")
+            result_embed.set_image(url=f"attachment://{self.machine.result_name}")
 
             return result_embed, spinning_file, result_file
 
         async def send_slot_result(embed, file, view=None):
-            return await ctx.reply(embed=embed, file=file, view=view)
+            return await self.outbox.reply(
+                ctx, final=False, embed=embed, file=file, view=view
+            )
 
-        result_embed, spinning_file, result_file = await play_slots(bet)
+        async with self.sessions.session(ctx.author.id, "slots", bet):
+            result_embed, spinning_file, result_file = await play_slots(bet)
 
-        spinning_embed = make_embed(
-            title="Spinning the slot machine...", color=discord.Color.blue()
-        )
+            spinning_embed = make_embed(
+                title="Spinning the slot machine...", color=discord.Color.blue()
+            )
 
-        spinning_embed.set_image(url="attachment://slot_result.gif")
+            spinning_embed.set_image(url=f"attachment://{self.machine.spinning_name}")
 
-        msg = await send_slot_result(spinning_embed, spinning_file)
+            msg = await send_slot_result(spinning_embed, spinning_file)
 
-        await asyncio.sleep(5)
+            await asyncio.sleep(5)
 
-        view = await SlotView(self, bet, ctx).start(msg)
-        await msg.edit(embed=result_embed, attachments=[result_file], view=view)
-        self.active_players.remove(ctx.author.id)
+            view = await SlotView(self, bet, ctx).start(msg)
+            await self.outbox.edit(
+                msg,
+                final=True,
+                embed=result_embed,
+                attachments=[result_file],
+                view=view,
+            )
 
         while True:
             try:
                 await view.wait()
                 if view.value == "reroll":
-                    if ctx.author.id in self.active_players:
+                    if self.sessions.is_busy(ctx.author.id):
                         return
 
-                    self.active_players.add(ctx.author.id)
-                    result_embed, spinning_file, result_file = await play_slots(bet)
-
-                    spinning_embed.title = (
-                        f"<@{ctx.author.id}> Rerolled! Spinning the slot machine..."
-                    )
-                    await msg.edit(embed=spinning_embed, attachments=[spinning_file])
-
-                    await asyncio.sleep(5)
-
-                    view = await SlotView(self, bet, ctx).start(msg)
-                    await msg.edit(
-                        embed=result_embed, attachments=[result_file], view=view
-                    )
-                    self.active_players.remove(ctx.author.id)
+                    async with self.sessions.session(ctx.author.id, "slots", bet):
+                        result_embed, spinning_file, result_file = await play_slots(bet)
+
+                        spinning_embed.title = (
+                            f"<@{ctx.author.id}> Rerolled! Spinning the slot machine..."
+                        )
+                        # Not waited for: if the channel is too busy to send
+                        # it within the spin, the result replaces it
+                        self.outbox.edit(
+                            msg, embed=spinning_embed, attachments=[spinning_file]
+                        )
+
+                        await asyncio.sleep(5)
+
+                        view = await SlotView(self, bet, ctx).start(msg)
+                        await self.outbox.edit(
+                            msg,
+                            final=True,
+                            embed=result_embed,
+                            attachments=[result_file],
+                            view=view,
+                        )
                 else:
                     break
             except Exception as e:
                 print(f"An error occurred: {e}")
                 break
 
-    def create_optimized_gif(self, images, duration, loop):
-        with io.BytesIO() as image_binary:
-            images[0].save(
-                image_binary,
-                format="GIF",
-                save_all=True,
-                append_images=images[1:],
-                duration=duration,
-                loop=loop,
-                optimize=True,
-                quality=10,
-            )
-            image_binary.seek(0)
-            return discord.File(fp=image_binary, filename="slot_result.gif")
+    def attachment(self, data: bytes, filename: str) -> discord.File:
+        return discord.File(fp=io.BytesIO(data), filename=filename)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def slotcache(self, ctx: commands.Context):
+        embed = make_stats_embed("Slot animation cache", self.machine.cache.stats())
+        await ctx.reply(embed=embed)
 
     @commands.command(
         brief=f"Purchase credits. Each credit is worth ${DEFAULT_BET}.",
@@ -232,12 +243,8 @@ class Slots(commands.Cog):
         aliases=["buy", "b"],
     )
     async def buyc(self, ctx: commands.Context, amount_to_buy: int):
-        user_id = ctx.author.id
-        profile = self.economy.get_entry(user_id)
         cost = amount_to_buy * DEFAULT_BET
-        if profile[1] >= cost:
-            self.economy.add_money(user_id, cost * -1)
-            self.economy.add_credits(user_id, amount_to_buy)
+        await self.economy.exchange(ctx.author.id, -cost, amount_to_buy, reason="buyc")
         await ctx.invoke(self.client.get_command("money"))
 
     @commands.command(
@@ -246,11 +253,9 @@ class Slots(commands.Cog):
         aliases=["sell", "s"],
     )
     async def sellc(self, ctx: commands.Context, amount_to_sell: int):
-        user_id = ctx.author.id
-        profile = self.economy.get_entry(user_id)
-        if profile[2] >= amount_to_sell:
-            self.economy.add_credits(user_id, amount_to_sell * -1)
-            self.economy.add_money(user_id, amount_to_sell * DEFAULT_BET)
+        await self.economy.exchange(
+            ctx.author.id, amount_to_sell * DEFAULT_BET, -amount_to_sell, reason="sellc"
+        )
         await ctx.invoke(self.client.get_command("money"))
 
 
@@ -0,0 +1,154 @@
+"""Streaming export and import of the economy table as CSV or JSON Lines.
+
+The format is picked from the file extension (.csv, .jsonl or .json).
+Rows are read and written one at a time, and imports are upserted in
+chunks, each in its own short transaction, so memory stays flat and a
+running bot only ever waits for one chunk. A snapshot is taken once the
+import is done, so the ledger treats the imported balances as the new
+starting point.
+
+Run from the discord/ folder:
+
+    python -m modules.bulk export|import <file> [chunk size]
+
+The database, and how many shards it is split over, come from the
+economy: section of config.yml.
+
+Stop the bot before running an import: it keeps balances in memory and
+writes them back later, over whatever was imported. The tool refuses to
+start while the bot's .pid file sits next to the database. To import
+into a running bot, use the owner-only $import command instead.
+"""
+import csv
+import heapq
+import json
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from modules.shards import partition
+
+if TYPE_CHECKING:
+    from modules.economy import Economy
+
+Entry = Tuple[int, int, int, int]
+
+FIELDS = ("user_id", "money", "credits", "kidneys")
+DEFAULTS = {"money": 0, "credits": 0, "kidneys": 2}
+CHUNK_SIZE = 10000
+
+
+def _is_csv(path: str) -> bool:
+    suffix = Path(path).suffix.lower()
+    if suffix not in (".csv", ".jsonl", ".json"):
+        raise ValueError(f"Unknown format {suffix!r}, use .csv or .jsonl")
+    return suffix == ".csv"
+
+
+def _entry(row: dict) -> Entry:
+    return tuple(
+        int(DEFAULTS.get(field, 0) if row.get(field) in (None, "") else row[field])
+        for field in FIELDS
+    )
+
+
+def read_entries(path: str) -> Iterator[Entry]:
+    """Yields one entry per row; missing columns get the defaults"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if _is_csv(path):
+            yield from map(_entry, csv.DictReader(f))
+        else:
+            yield from (_entry(json.loads(line)) for line in f if line.strip())
+
+
+def write_entries(path: str, entries: Iterable[Entry]) -> int:
+    """Writes every entry and returns how many there were"""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if _is_csv(path):
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for count, entry in enumerate(entries, 1):
+                writer.writerow(entry)
+        else:
+            for count, entry in enumerate(entries, 1):
+                f.write(json.dumps(dict(zip(FIELDS, entry))) + "\n")
+    return count
+
+
+def chunked(entries: Iterable[Entry], size: int) -> Iterator[List[Entry]]:
+    entries = iter(entries)
+    while chunk := list(islice(entries, size)):
+        yield chunk
+
+
+class Progress:
+    """Prints how far an import has got, at most every ``every`` seconds"""
+
+    def __init__(self, every: float = 1):
+        self.every = every
+        self.started = self.printed = time.monotonic()
+
+    def __call__(self, rows: int, done: bool = False) -> Optional[str]:
+        now = time.monotonic()
+        if not done and now - self.printed < self.every:
+            return None
+        self.printed = now
+        elapsed = now - self.started
+        message = (
+            f"{rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f}/s)"
+        )
+        print(message)
+        return message
+
+
+def import_file(
+    economies: List["Economy"],
+    path: str,
+    chunk_size: int = CHUNK_SIZE,
+    progress: Callable[[int], object] = None,
+) -> int:
+    """Upserts every row of the file into synchronous Economies, one per
+    shard in shard order"""
+    rows = 0
+    for chunk in chunked(read_entries(path), chunk_size):
+        for shard, entries in partition(chunk, len(economies)).items():
+            economies[shard].write_entries(entries)
+        rows += len(chunk)
+        if progress:
+            progress(rows)
+    for economy in economies:
+        economy.snapshot()
+    return rows
+
+
+def main(command: str, path: str, chunk_size: str = CHUNK_SIZE):
+    from modules.economy import Economy, configured_paths, held_by
+
+    paths = configured_paths()
+    if command == "import" and (pid_file := held_by(paths)):
+        raise SystemExit(
+            f"The bot has the database open ({pid_file}). Stop it first, or "
+            "import with the $import command; delete the file if the bot "
+            "crashed."
+        )
+    economies = [Economy(path=shard) for shard in paths]
+    progress = Progress()
+    if command == "export":
+        # Every shard is in user_id order, so merging keeps the file in order
+        rows = write_entries(
+            path, heapq.merge(*(economy.entries() for economy in economies))
+        )
+    elif command == "import":
+        rows = import_file(economies, path, int(chunk_size), progress)
+    else:
+        raise SystemExit(f"Unknown command {command}")
+    progress(rows, done=True)
+    for economy in economies:
+        economy.close()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
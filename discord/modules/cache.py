@@ -0,0 +1,119 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+Entry = Tuple[int, int, int, int]
+Leg = Tuple[int, int, int, int]  # (user_id, money, credits, kidneys) deltas
+
+
+def combine_legs(legs: Iterable[Leg]) -> Dict[int, List[int]]:
+    """Net [money, credits, kidneys] change per user, so preconditions are
+    checked against the final balance when a user appears more than once"""
+    totals: Dict[int, List[int]] = {}
+    for user_id, *deltas in legs:
+        total = totals.setdefault(user_id, [0, 0, 0])
+        for i, delta in enumerate(deltas):
+            total[i] += delta
+    return totals
+
+
+class AccountCache:
+    """In-memory copy of the economy table, keyed by user_id.
+
+    Mirrors the mutating methods of Economy so a balance change can be
+    applied in memory straight away. Changed accounts are remembered as
+    dirty until drain() hands them over to be written in one batch."""
+
+    def __init__(self):
+        self.accounts: Dict[int, List[int]] = {}
+        self._dirty: Set[int] = set()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.accounts
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    @property
+    def dirty(self) -> int:
+        """Number of accounts waiting to be written"""
+        return len(self._dirty)
+
+    def _entry(self, user_id: int) -> Entry:
+        money, credits, kidneys = self.accounts[user_id]
+        return user_id, money, credits, kidneys
+
+    def get_entry(self, user_id: int) -> Optional[Entry]:
+        if user_id in self.accounts:
+            return self._entry(user_id)
+        return None
+
+    def load(self, entry: Entry) -> Entry:
+        """Caches an entry read from the database"""
+        self.accounts[entry[0]] = list(entry[1:])
+        return entry
+
+    def new_entry(self, user_id: int) -> Entry:
+        if user_id not in self.accounts:
+            self.accounts[user_id] = [0, 0, 2]
+            self._dirty.add(user_id)
+        return self._entry(user_id)
+
+    def remove_entry(self, user_id: int) -> None:
+        self.accounts.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    def _set(self, user_id: int, column: int, value: int) -> Entry:
+        self.accounts[user_id][column] = value
+        self._dirty.add(user_id)
+        return self._entry(user_id)
+
+    def set_money(self, user_id: int, money: int) -> Entry:
+        return self._set(user_id, 0, money)
+
+    def set_credits(self, user_id: int, credits: int) -> Entry:
+        return self._set(user_id, 1, credits)
+
+    def set_kidneys(self, user_id: int, kidneys: int) -> Entry:
+        return self._set(user_id, 2, kidneys)
+
+    def add_money(self, user_id: int, money_to_add: int) -> Entry:
+        return self._set(user_id, 0, max(0, self.accounts[user_id][0] + money_to_add))
+
+    def add_credits(self, user_id: int, credits_to_add: int) -> Entry:
+        return self._set(user_id, 1, max(0, self.accounts[user_id][1] + credits_to_add))
+
+    def settle_bet(
+        self, user_id: int, bet: int, delta: int, column: str = "money"
+    ) -> Optional[Entry]:
+        """Applies delta only if the balance covers bet"""
+        if column not in ("money", "credits"):
+            raise ValueError(f"Can't bet with {column}")
+        index = 0 if column == "money" else 1
+        balance = self.accounts[user_id][index]
+        if balance < bet:
+            return None
+        return self._set(user_id, index, max(0, balance + delta))
+
+    def transfer(self, legs: Iterable[Leg]) -> Optional[List[Entry]]:
+        """Applies every leg, or none of them if any balance would go
+        negative. Returns the changed entries, or None when refused."""
+        totals = combine_legs(legs)
+        for user_id, deltas in totals.items():
+            account = self.accounts[user_id]
+            if any(value + delta < 0 for value, delta in zip(account, deltas)):
+                return None
+        for user_id, deltas in totals.items():
+            account = self.accounts[user_id]
+            for i, delta in enumerate(deltas):
+                account[i] += delta
+            self._dirty.add(user_id)
+        return [self._entry(user_id) for user_id in totals]
+
+    def drain(self) -> List[Entry]:
+        """Returns every dirty account and marks them clean"""
+        rows = [self._entry(user_id) for user_id in self._dirty]
+        self._dirty.clear()
+        return rows
+
+    def mark_dirty(self, user_ids: Iterable[int]) -> None:
+        """Queues accounts again, e.g. after a failed write"""
+        self._dirty.update(u for u in user_ids if u in self.accounts)
@@ -1,32 +1,104 @@
-import os
+import random
+
+
+# Cards are ints from 0 to 51, four suits to each value from 2 up to the
+# ace: card = (value - 2) * 4 + suit. Everything about a card is looked
+# up in the tables below rather than worked out again.
+SUITS = ["clubs", "diamonds", "hearts", "spades"]
+SUIT_SYMBOLS = ["♣", "♦", "♥", "♠"]
+ACE = 14
+DECK = 52
+
+NAMES = {11: 'jack', 12: 'queen', 13: 'king', ACE: 'ace'}
+
+VALUES = tuple(card // 4 + 2 for card in range(DECK))
+SUIT_NAMES = tuple(SUITS[card % 4] for card in range(DECK))
+VALUE_NAMES = tuple(NAMES.get(value, str(value)) for value in VALUES)
+SYMBOLS = tuple(name[0].upper() for name in VALUE_NAMES)
+IMAGES = tuple(
+    f"{symbol if name != '10' else '10'}{suit[0].upper()}.png"
+    for symbol, name, suit in zip(SYMBOLS, VALUE_NAMES, SUIT_NAMES)
+)
+BACK_IMAGE = "red_back.png"
+# Short text for a card, like 10♥ or K♠
+LABELS = tuple(
+    f"{symbol if name != '10' else '10'}{SUIT_SYMBOLS[card % 4]}"
+    for card, (symbol, name) in enumerate(zip(SYMBOLS, VALUE_NAMES))
+)
+# Blackjack points, aces as 1
+POINTS = tuple(1 if value == ACE else min(value, 10) for value in VALUES)
+ACES = tuple(int(value == ACE) for value in VALUES)
+
+
+def card_id(suit: str, value: int) -> int:
+    return (value - 2) * 4 + SUITS.index(suit)
+
+
+class Shoe:
+    """``decks`` decks of cards, dealt as ints.
+
+    The shoe shuffles as it deals: each draw swaps a random card from the
+    rest of the shoe to the front, one step of a Fisher-Yates shuffle, so
+    a hand only pays for the cards it uses. shuffle() puts every card back
+    without touching them, since the cards are a permutation of the shoe
+    whatever order they were left in."""
+
+    def __init__(self, decks: int = 1, rng=random):
+        self.cards = list(range(DECK)) * decks
+        self.dealt = 0
+        self.rng = rng
+
+    def __len__(self) -> int:
+        return len(self.cards) - self.dealt
+
+    def shuffle(self) -> None:
+        self.dealt = 0
+
+    def draw(self) -> int:
+        cards, dealt = self.cards, self.dealt
+        pick = self.rng.randrange(dealt, len(cards))
+        cards[dealt], cards[pick] = cards[pick], cards[dealt]
+        self.dealt = dealt + 1
+        return cards[dealt]
 
 
 class Card:
-    suits = ["clubs", "diamonds", "hearts", "spades"]
+    """A view of one card for code that wants objects, cards are ints
+    everywhere else"""
+    __slots__ = ("id", "down")
+    suits = SUITS
+
     def __init__(self, suit: str, value: int, down=False):
-        self.suit = suit
-        self.value = value
+        self.id = card_id(suit, value)
+        self.down = down
+
+    @classmethod
+    def from_id(cls, card: int, down=False) -> "Card":
+        self = cls.__new__(cls)
+        self.id = card
         self.down = down
-        self.symbol = self.name[0].upper()
+        return self
+
+    @property
+    def suit(self) -> str:
+        return SUIT_NAMES[self.id]
+
+    @property
+    def value(self) -> int:
+        return VALUES[self.id]
 
     @property
     def name(self) -> str:
         """The name of the card value."""
-        if self.value <= 10: return str(self.value)
-        else: return {
-            11: 'jack',
-            12: 'queen',
-            13: 'king',
-            14: 'ace',
-        }[self.value]
+        return VALUE_NAMES[self.id]
+
+    @property
+    def symbol(self) -> str:
+        return SYMBOLS[self.id]
 
     @property
     def image(self):
-        return (
-            f"{self.symbol if self.name != '10' else '10'}"\
-            f"{self.suit[0].upper()}.png" \
-            if not self.down else "red_back.png"
-        )
+        return IMAGES[self.id] if not self.down else BACK_IMAGE
 
     def flip(self):
         self.down = not self.down
@@ -0,0 +1,124 @@
+import functools
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+from PIL import Image
+
+from modules.card import Card
+
+FOLDER = Path(__file__).parent
+
+Box = Tuple[int, int, int, int]
+
+
+class CardAtlas:
+    """Every card face, the card back and the blackjack table, decoded once.
+
+    The cards sit side by side on one RGBA sheet and are drawn straight off
+    it by their crop box, so a table render opens no files at all. The
+    sheet and table are only ever read from, so one atlas serves every
+    render in the process."""
+
+    def __init__(self, folder: Path = FOLDER):
+        names = [
+            Card(suit, value).image for suit in Card.suits for value in range(2, 15)
+        ]
+        names.append(Card(Card.suits[0], 2, down=True).image)
+        cards = [Image.open(folder / "cards" / name).convert("RGBA") for name in names]
+        self.card_size = width, height = cards[0].size
+        self.sheet = Image.new("RGBA", (width * len(cards), height))
+        self.boxes: Dict[str, Box] = {}
+        for i, (name, card) in enumerate(zip(names, cards)):
+            if card.size != self.card_size:
+                raise ValueError(f"{name} isn't {width}x{height}")
+            self.sheet.paste(card, (i * width, 0))
+            self.boxes[name] = (i * width, 0, (i + 1) * width, height)
+        self.table = Image.open(folder / "table.png").convert("RGBA")
+
+    def draw(self, image: Image.Image, card: str, xy: Tuple[int, int]) -> None:
+        """Composites the card, by image file name, onto image at xy"""
+        image.alpha_composite(self.sheet, xy, self.boxes[card])
+
+    def stats(self) -> Dict[str, int]:
+        sheet = len(self.sheet.getbands()) * self.sheet.width * self.sheet.height
+        table = len(self.table.getbands()) * self.table.width * self.table.height
+        return {
+            "cards": len(self.boxes),
+            "sheet_bytes": sheet,
+            "table_bytes": table,
+            "total_bytes": sheet + table,
+        }
+
+
+class TableRenderer:
+    """Draws blackjack tables off a CardAtlas, each hand in a centred row.
+
+    Tables with more hands than fit on the background, at a multiplayer
+    table, are drawn on the background stretched taller; the last few
+    stretched backgrounds are kept, since there are only as many as there
+    are table sizes. They are kept under a lock, since inline jobs run in
+    threads."""
+
+    # Space between cards in a row, and between rows
+    gap_x = 10
+    gap_y = 15
+    # Share of a stretched background's height left above and below the
+    # rows, clear of the rim
+    margin = 0.12
+    backgrounds = 2
+
+    def __init__(self, atlas: CardAtlas):
+        self.atlas = atlas
+        self._backgrounds: OrderedDict[int, Image.Image] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"stretched": 0}
+
+    def background(self, rows: int) -> Image.Image:
+        """The table, stretched taller if that many rows don't fit on it"""
+        height = rows * (self.atlas.card_size[1] + self.gap_y) - self.gap_y
+        if height <= self.atlas.table.height:
+            return self.atlas.table
+        height = int(height / (1 - 2 * self.margin))
+        with self._lock:
+            table = self._backgrounds.get(height)
+            if table is not None:
+                self._backgrounds.move_to_end(height)
+                return table
+
+        table = self.atlas.table.resize((self.atlas.table.width, height), Image.LANCZOS)
+        with self._lock:
+            self.counters["stretched"] += 1
+            self._backgrounds[height] = table
+            while len(self._backgrounds) > self.backgrounds:
+                self._backgrounds.popitem(last=False)
+        return table
+
+    def draw(self, hands: Sequence[Sequence[str]]) -> Image.Image:
+        """The table with each hand in a centred row"""
+        bg = self.background(len(hands)).copy()
+        width, height = self.atlas.card_size
+        y = bg.height // 2 - (len(hands) * (height + self.gap_y) - self.gap_y) // 2
+        for hand in hands:
+            x = bg.width // 2 - (len(hand) * (width + self.gap_x) - self.gap_x) // 2
+            for card in hand:
+                self.atlas.draw(bg, card, (x, y))
+                x += width + self.gap_x
+            y += height + self.gap_y
+        return bg
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters, backgrounds=len(self._backgrounds))
+
+
+@functools.lru_cache(maxsize=None)
+def card_atlas() -> CardAtlas:
+    """The process's atlas, loaded on first use"""
+    return CardAtlas()
+
+
+@functools.lru_cache(maxsize=None)
+def table_renderer() -> TableRenderer:
+    """The process's renderer, drawing from its atlas"""
+    return TableRenderer(card_atlas())
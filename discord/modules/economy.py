@@ -1,84 +1,185 @@
+import asyncio
+import heapq
+import os
 import sqlite3
 import random
-from functools import wraps
-from typing import Tuple, List
-from time import sleep
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from itertools import chain, islice
+from pathlib import Path
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    List,
+)
+
+from modules import bulk, ledger, migrations
+from modules.cache import AccountCache, Leg, combine_legs
+from modules.leaderboard import Leaderboard
+from modules.memory import MemoryEconomy
+from modules.sampling import AccountSampler
+from modules.shards import partition, shard_of, shard_paths
 
 Entry = Tuple[int, int, int]
 
+RETURNING = "RETURNING user_id, money, credits, kidneys"
+
+# Relative database paths are resolved against the discord/ folder
+FOLDER = Path(__file__).parent.parent
+DEFAULT_PATH = str(FOLDER / "economy.db")
+
+
+def configured_paths() -> List[str]:
+    """The database file of every shard set up under economy: in config.yml,
+    found the way AsyncEconomy finds them, for the command line tools"""
+    from modules.helpers import ECONOMY_CONFIG
+
+    if ECONOMY_CONFIG.get("backend", "sqlite") != "sqlite":
+        raise SystemExit("The economy isn't kept in SQLite files")
+    path = ECONOMY_CONFIG.get("path", DEFAULT_PATH)
+    return shard_paths(str(FOLDER / path), ECONOMY_CONFIG.get("shards", 1))
+
+
+def pid_file(path: str) -> Path:
+    """Written next to a database while AsyncEconomy has it open"""
+    return Path(path + ".pid")
+
+
+def held_by(paths: Iterable[str]) -> Optional[str]:
+    """The pid file of the first database a running bot has open, if any.
+
+    A bot that crashed leaves its file behind; it has to be deleted by hand
+    once the bot is known to be stopped."""
+    for path in paths:
+        if pid_file(path).exists():
+            return str(pid_file(path))
+    return None
+
 
 class Economy:
     """A wrapper for the economy database"""
 
-    def __init__(self):
+    # Read-only connections can run on other threads alongside the writer
+    concurrent_reads = True
+
+    def __init__(
+        self,
+        timeout: float = 30,
+        readonly: bool = False,
+        path: str = DEFAULT_PATH,
+        cache_mb: int = 16,
+        mmap_mb: int = 64,
+    ):
+        self.timeout = timeout
+        self.readonly = readonly
+        self.path = path
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
         self.open()
 
+    def _tune(self):
+        """Sizes the page cache and memory map for this connection"""
+        self.conn.execute(f"PRAGMA cache_size = {-1024 * self.cache_mb}")
+        self.conn.execute(f"PRAGMA mmap_size = {1024 * 1024 * self.mmap_mb}")
+
     def open(self):
         """Initializes the database"""
-        self.conn = sqlite3.connect("economy.db", timeout=30)
+        if self.readonly:
+            # Readers may be closed from another thread on shutdown
+            self.conn = sqlite3.connect(
+                f"{Path(self.path).absolute().as_uri()}?mode=ro",
+                uri=True,
+                timeout=self.timeout,
+                check_same_thread=False,
+            )
+            self.cur = self.conn.cursor()
+            self._tune()
+            return
+        self.conn = sqlite3.connect(self.path, timeout=self.timeout)
         self.conn.execute("PRAGMA journal_mode=WAL;")
         self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self._tune()
         self.cur = self.conn.cursor()
-        self.cur.execute(
-            """CREATE TABLE IF NOT EXISTS economy (
-            user_id INTEGER NOT NULL PRIMARY KEY,
-            money INTEGER NOT NULL DEFAULT 0,
-            credits INTEGER NOT NULL DEFAULT 0
-        )"""
-        )
-
-        # Check if kidneys column exists, if not, add it
-        if not self._check_kidneys_column_exists():
-            self._add_kidneys_column()
+        # Only reads user_version once the schema is up to date
+        migrations.migrate(self.conn)
 
     def close(self):
         """Safely closes the database"""
         if self.conn:
             self.conn.commit()
+            if not self.readonly:
+                self.optimize()
             self.cur.close()
             self.conn.close()
 
+    def checkpoint(self, mode: str = "PASSIVE") -> Tuple[int, int, int]:
+        """Copies the WAL back into the database file. Returns (busy, pages
+        in the WAL, pages checkpointed); TRUNCATE also empties the WAL file
+        if no reader is still using it."""
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown checkpoint mode {mode}")
+        return self.conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def optimize(self) -> None:
+        """Refreshes the query planner statistics that need it"""
+        self.conn.execute("PRAGMA optimize")
+
+    def file_sizes(self) -> Tuple[int, int]:
+        """Bytes on disk of the database and its WAL"""
+        sizes = []
+        for path in (self.path, f"{self.path}-wal"):
+            try:
+                sizes.append(os.path.getsize(path))
+            except OSError:
+                sizes.append(0)
+        return tuple(sizes)
+
     def _commit(func):
+        """Commits on success and rolls back on failure.
+
+        Retrying a locked database is left to the caller (see AsyncEconomy),
+        so the calling thread is never put to sleep here."""
+
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            retries = 5
-            delay = 0.1
-            for i in range(retries):
-                try:
-                    result = func(self, *args, **kwargs)
-                    self.conn.commit()
-                    return result
-                except sqlite3.OperationalError as e:
-                    self.conn.rollback()
-                    if "locked" in str(e):
-                        sleep(delay)
-                        delay *= 2
-                    else:
-                        raise
-            raise sqlite3.OperationalError("Database is locked")
+            try:
+                result = func(self, *args, **kwargs)
+                self.conn.commit()
+                return result
+            except sqlite3.OperationalError:
+                self.conn.rollback()
+                raise
 
         return wrapper
 
-    def get_entry(self, user_id: int) -> Tuple[int, int, int, int]:
+    def find_entry(self, user_id: int) -> Optional[Tuple[int, int, int, int]]:
+        """Like get_entry, but returns None instead of creating the row"""
         self.cur.execute(
             "SELECT user_id, money, credits, COALESCE(kidneys, 2) as kidneys FROM economy WHERE user_id=:user_id",
             {"user_id": user_id},
         )
-        result = self.cur.fetchone()
+        return self.cur.fetchone()
+
+    def get_entry(self, user_id: int) -> Tuple[int, int, int, int]:
+        result = self.find_entry(user_id)
         if result:
             return result
         return self.new_entry(user_id)
 
     @_commit
     def new_entry(self, user_id: int) -> Entry:
-        try:
-            self.cur.execute(
-                "INSERT INTO economy(user_id, money, credits) VALUES(?,?,?)",
-                (user_id, 0, 0),
-            )
-            return self.get_entry(user_id)
-        except sqlite3.IntegrityError:
-            return self.get_entry(user_id)
+        self.cur.execute(
+            "INSERT OR IGNORE INTO economy(user_id, money, credits) VALUES(?,?,?)",
+            (user_id, 0, 0),
+        )
+        return self.find_entry(user_id)
 
     @_commit
     def remove_entry(self, user_id: int) -> None:
@@ -86,68 +187,901 @@ class Economy:
             "DELETE FROM economy WHERE user_id=:user_id", {"user_id": user_id}
         )
 
+    def _balances_before(self, user_id: int) -> Tuple[int, int]:
+        """Opens the write transaction and reads the (money, credits) that a
+        change is recorded in the ledger against"""
+        if not self.conn.in_transaction:
+            self.cur.execute("BEGIN IMMEDIATE")
+        entry = self.find_entry(user_id)
+        return (entry[1], entry[2]) if entry else (0, 0)
+
+    def _record(
+        self,
+        before: Tuple[int, int],
+        entry: Optional[Entry],
+        game: Optional[str],
+        reason: Optional[str],
+    ) -> Optional[Entry]:
+        """Appends what the change did to the balances to the ledger, in the
+        change's own transaction"""
+        if entry:
+            money, credits = entry[1] - before[0], entry[2] - before[1]
+            if money or credits:
+                ledger.append(
+                    self.cur, [(time.time(), entry[0], game, money, credits, reason)]
+                )
+        return entry
+
+    def _upsert(
+        self,
+        column: str,
+        insert_value: str,
+        update_value: str,
+        game: str = None,
+        reason: str = None,
+        **params,
+    ):
+        """Creates or updates the row and returns it in a single statement,
+        and records the change in the ledger"""
+        before = self._balances_before(params["user_id"])
+        self.cur.execute(
+            f"""INSERT INTO economy(user_id, {column}) VALUES(:user_id, {insert_value})
+            ON CONFLICT(user_id) DO UPDATE SET {column} = {update_value}
+            {RETURNING}""",
+            params,
+        )
+        return self._record(before, self.cur.fetchone(), game, reason)
+
     @_commit
-    def set_money(self, user_id: int, money: int) -> Entry:
-        self.cur.execute("UPDATE economy SET money=? WHERE user_id=?", (money, user_id))
-        return self.get_entry(user_id)
+    def set_money(
+        self, user_id: int, money: int, game: str = None, reason: str = "set"
+    ) -> Entry:
+        return self._upsert(
+            "money",
+            ":value",
+            "excluded.money",
+            game,
+            reason,
+            user_id=user_id,
+            value=money,
+        )
 
     @_commit
-    def set_credits(self, user_id: int, credits: int) -> Entry:
-        self.cur.execute(
-            "UPDATE economy SET credits=? WHERE user_id=?", (credits, user_id)
+    def set_credits(
+        self, user_id: int, credits: int, game: str = None, reason: str = "set"
+    ) -> Entry:
+        return self._upsert(
+            "credits",
+            ":value",
+            "excluded.credits",
+            game,
+            reason,
+            user_id=user_id,
+            value=credits,
+        )
+
+    @_commit
+    def add_money(
+        self, user_id: int, money_to_add: int, game: str = None, reason: str = None
+    ) -> Entry:
+        return self._upsert(
+            "money",
+            "max(0, :value)",
+            "max(0, money + :value)",
+            game,
+            reason,
+            user_id=user_id,
+            value=money_to_add,
         )
-        return self.get_entry(user_id)
 
     @_commit
-    def add_money(self, user_id: int, money_to_add: int) -> Entry:
-        money = self.get_entry(user_id)[1]
-        total = money + money_to_add
-        if total < 0:
-            total = 0
-        self.set_money(user_id, total)
-        return self.get_entry(user_id)
+    def add_credits(
+        self, user_id: int, credits_to_add: int, game: str = None, reason: str = None
+    ) -> Entry:
+        return self._upsert(
+            "credits",
+            "max(0, :value)",
+            "max(0, credits + :value)",
+            game,
+            reason,
+            user_id=user_id,
+            value=credits_to_add,
+        )
 
     @_commit
-    def add_credits(self, user_id: int, credits_to_add: int) -> Entry:
-        credits = self.get_entry(user_id)[2]
-        total = credits + credits_to_add
-        if total < 0:
-            total = 0
-        self.set_credits(user_id, total)
-        return self.get_entry(user_id)
-
-    def random_entry(self) -> Entry:
-        self.cur.execute("SELECT * FROM economy")
-        return random.choice(self.cur.fetchall())
-
-    def top_entries(self, n: int = 0) -> List[Entry]:
-        self.cur.execute("SELECT * FROM economy ORDER BY money DESC")
-        return self.cur.fetchmany(n) if n else self.cur.fetchall()
-
-    def _check_kidneys_column_exists(self):
-        self.cur.execute("PRAGMA table_info(economy)")
-        columns = [column[1] for column in self.cur.fetchall()]
-        return "kidneys" in columns
+    def settle_bet(
+        self,
+        user_id: int,
+        bet: int,
+        delta: int,
+        column: str = "money",
+        game: str = None,
+        reason: str = "bet",
+    ) -> Optional[Entry]:
+        """Applies delta only if the balance covers bet, in one statement.
+
+        Returns the updated entry, or None when the balance is too low, so
+        checking a bet and paying it out can't be split by another write."""
+        if column not in ("money", "credits"):
+            raise ValueError(f"Can't bet with {column}")
+        before = self._balances_before(user_id)
+        self.cur.execute(
+            f"""UPDATE economy SET {column} = max(0, {column} + :delta)
+            WHERE user_id=:user_id AND {column} >= :bet
+            {RETURNING}""",
+            {"user_id": user_id, "bet": bet, "delta": delta},
+        )
+        return self._record(before, self.cur.fetchone(), game, reason)
+
+    def transfer(
+        self, legs: List[Leg], game: str = None, reason: str = None
+    ) -> Optional[List[Entry]]:
+        return self.transfer_many([legs], game, reason)[0]
 
     @_commit
-    def _add_kidneys_column(self):
+    def transfer_many(
+        self, transfers: List[List[Leg]], game: str = None, reason: str = None
+    ) -> List[Optional[List[Entry]]]:
+        """Applies each transfer's (user_id, money, credits, kidneys) legs
+        all-or-nothing, refusing any that would leave a balance negative.
+
+        Every transfer shares one commit; a refused one is rolled back to its
+        savepoint and comes back as None."""
+        if not self.conn.in_transaction:
+            self.cur.execute("BEGIN")
+        results = []
+        for legs in transfers:
+            totals = combine_legs(legs)
+            entries = []
+            self.cur.execute("SAVEPOINT transfer")
+            for user_id, (money, credits, kidneys) in totals.items():
+                self.cur.execute(
+                    "INSERT OR IGNORE INTO economy(user_id) VALUES(?)", (user_id,)
+                )
+                self.cur.execute(
+                    f"""UPDATE economy SET money = money + :money,
+                    credits = credits + :credits, kidneys = kidneys + :kidneys
+                    WHERE user_id=:user_id AND money + :money >= 0
+                    AND credits + :credits >= 0 AND kidneys + :kidneys >= 0
+                    {RETURNING}""",
+                    {
+                        "user_id": user_id,
+                        "money": money,
+                        "credits": credits,
+                        "kidneys": kidneys,
+                    },
+                )
+                entry = self.cur.fetchone()
+                if entry is None:
+                    break
+                entries.append(entry)
+            if len(entries) < len(totals):
+                self.cur.execute("ROLLBACK TO transfer")
+                entries = None
+            else:
+                now = time.time()
+                ledger.append(
+                    self.cur,
+                    (
+                        (now, user_id, game, money, credits, reason)
+                        for user_id, (money, credits, _) in totals.items()
+                        if money or credits
+                    ),
+                )
+            self.cur.execute("RELEASE transfer")
+            results.append(entries)
+        return results
+
+    def random_entry(self) -> Optional[Entry]:
+        """A random account, found by probing the primary key.
+
+        Costs two index lookups rather than reading the table. user_ids are
+        sparse, so accounts after a large gap come up more often; use
+        AsyncEconomy.random_entry when every account needs the same odds."""
+        self.cur.execute("SELECT min(user_id), max(user_id) FROM economy")
+        low, high = self.cur.fetchone()
+        if low is None:
+            return None
         self.cur.execute(
-            "ALTER TABLE economy ADD COLUMN kidneys INTEGER NOT NULL DEFAULT 2"
+            """SELECT user_id, money, credits, kidneys FROM economy
+            WHERE user_id >= ? ORDER BY user_id LIMIT 1""",
+            (random.randint(low, high),),
+        )
+        return self.cur.fetchone()
+
+    def balances(self) -> Iterator[Tuple[int, int]]:
+        """Streams (user_id, money) for every account"""
+        return self.conn.execute("SELECT user_id, money FROM economy")
+
+    def entries(self) -> Iterator[Entry]:
+        """Streams every account in user_id order"""
+        return self.conn.execute(
+            "SELECT user_id, money, credits, kidneys FROM economy ORDER BY user_id"
+        )
+
+    def top_entries(self, n: int = 0, column: str = "money") -> List[Entry]:
+        """The n richest accounts (all of them if n is 0), read off the index"""
+        if column not in ("money", "credits"):
+            raise ValueError(f"Can't rank by {column}")
+        self.cur.execute(
+            f"""SELECT user_id, money, credits, kidneys FROM economy
+            ORDER BY {column} DESC LIMIT ?""",
+            (n or -1,),
+        )
+        return self.cur.fetchall()
+
+    @_commit
+    def write_entries(
+        self, entries: List[Entry], ledger_rows: List[ledger.LedgerRow] = ()
+    ) -> None:
+        """Writes whole accounts and the ledger rows behind them in one
+        transaction"""
+        self.stage_entries(entries, ledger_rows)
+
+    def stage_entries(
+        self, entries: List[Entry], ledger_rows: List[ledger.LedgerRow] = ()
+    ) -> None:
+        """write_entries without the commit, which is left to the caller"""
+        self.cur.executemany(
+            """INSERT INTO economy(user_id, money, credits, kidneys) VALUES(?,?,?,?)
+            ON CONFLICT(user_id) DO UPDATE SET money = excluded.money,
+            credits = excluded.credits, kidneys = excluded.kidneys""",
+            entries,
         )
-        self.cur.execute("UPDATE economy SET kidneys = 2 WHERE kidneys IS NULL")
+        ledger.append(self.cur, ledger_rows)
+
+    @_commit
+    def snapshot(self) -> int:
+        return ledger.snapshot(self.cur)
 
     @_commit
+    def rebuild(self) -> int:
+        return ledger.rebuild(self.cur)
+
+    def audit(self, limit: int = 0) -> List[ledger.Mismatch]:
+        """Accounts whose balance doesn't match the ledger (up to limit)"""
+        mismatches = ledger.audit(self.conn.cursor())
+        return list(islice(mismatches, limit or None))
+
     def remove_kidney(self, user_id: int) -> Entry:
-        entry = self.get_entry(user_id)
-        if entry[3] > 0:
-            new_kidney_count = entry[3] - 1
-            self.set_kidneys(user_id, new_kidney_count)
-            self.add_money(user_id, 10000)
-        return self.get_entry(user_id)
+        entries = self.transfer([(user_id, 10000, 0, -1)], reason="kidney")
+        return entries[0] if entries else self.get_entry(user_id)
 
     @_commit
     def set_kidneys(self, user_id: int, kidneys: int) -> Entry:
-        self.cur.execute(
-            "UPDATE economy SET kidneys=? WHERE user_id=?", (kidneys, user_id)
+        return self._upsert(
+            "kidneys", ":value", "excluded.kidneys", user_id=user_id, value=kidneys
+        )
+
+
+# Storage engines that can sit behind AsyncEconomy, chosen with "backend"
+BACKENDS = {"sqlite": Economy, "memory": MemoryEconomy}
+
+
+class AsyncEconomy:
+    """Bot-wide awaitable economy service.
+
+    Writes are serialized through one connection on a dedicated writer
+    thread, while lookups are spread over a small pool of read-only
+    connections. "database is locked" errors are retried with exponential
+    backoff using asyncio.sleep, so the event loop never blocks.
+
+    Balances are kept in an AccountCache. With a flush_interval, changes
+    are applied in memory and written behind in batched transactions at
+    least every flush_interval seconds, or sooner once flush_threshold
+    accounts are dirty; that interval is how much play a crash can lose.
+    A flush_interval of 0 writes every change through immediately.
+
+    ``backend`` picks the storage engine from BACKENDS: "sqlite" stores
+    the economy at ``path``, "memory" keeps it in process memory only.
+    With ``shards`` above 1 accounts are hash-partitioned over that many
+    SQLite files, each with its own writer thread; flushes that span
+    shards commit on every shard or on none.
+
+    One instance is attached to the bot as ``client.economy`` and shared by
+    every cog."""
+
+    def __init__(
+        self,
+        readers: int = 2,
+        retries: int = 5,
+        delay: float = 0.1,
+        timeout: float = 5,
+        flush_interval: float = 2,
+        flush_threshold: int = 500,
+        leaderboard_size: int = 10,
+        snapshot_interval: float = 3600,
+        backend: str = "sqlite",
+        path: str = DEFAULT_PATH,
+        shards: int = 1,
+        cache_mb: int = 16,
+        mmap_mb: int = 64,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown economy backend {backend!r}")
+        if shards > 1 and not BACKENDS[backend].concurrent_reads:
+            raise ValueError(f"The {backend} backend can't be sharded")
+        self.shards = shards
+        self.paths = shard_paths(str(FOLDER / path), shards)
+        self.retries = retries
+        self.delay = delay
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.snapshot_interval = snapshot_interval
+        self.counters: Dict[str, float] = {
+            "reads": 0,
+            "writes": 0,
+            "lock_waits": 0,
+            "retries": 0,
+            "lock_wait_seconds": 0.0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "leaderboard_refills": 0,
+            "ledger_rows": 0,
+            "snapshots": 0,
+            "checkpoints": 0,
+            "checkpointed_pages": 0,
+            "optimizes": 0,
+        }
+        self.cache = AccountCache()
+        self.leaderboard = Leaderboard(leaderboard_size)
+        self._refill_lock = asyncio.Lock()
+        self.sampler = AccountSampler()
+        self._sampler_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._ledger: List[ledger.LedgerRow] = []
+        self._snapshot_at = time.monotonic()
+        self._flush_now = asyncio.Event()
+        # Held from draining the cache until the write has landed, retries
+        # included, so an older flush can never land over a newer one
+        self._flush_lock = asyncio.Lock()
+        # A single writer per shard keeps every write on the thread that made
+        # the connection, and means cogs never compete for the WAL write lock.
+        self._writers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"economy-writer-{i}")
+            for i in range(shards)
+        ]
+        self._economies: List[Economy] = [
+            writer.submit(
+                BACKENDS[backend],
+                timeout,
+                path=path,
+                cache_mb=cache_mb,
+                mmap_mb=mmap_mb,
+            ).result()
+            for writer, path in zip(self._writers, self.paths)
+        ]
+        # Tells the command line tools the files are in use, see held_by()
+        self._pid_files = [pid_file(path) for path in self.paths if backend == "sqlite"]
+        for file in self._pid_files:
+            file.write_text(str(os.getpid()))
+
+        self._local = threading.local()
+        self._reader_conns: List[Economy] = []
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers, thread_name_prefix="economy-reader"
+        )
+
+    def _reader(self, shard: int) -> Economy:
+        """The current reader thread's read-only connection to a shard"""
+        economies = getattr(self._local, "economies", None)
+        if economies is None:
+            economies = self._local.economies = {}
+        economy = economies.get(shard)
+        if economy is None:
+            writer = self._economies[shard]
+            economy = economies[shard] = Economy(
+                self.timeout,
+                readonly=True,
+                path=self.paths[shard],
+                cache_mb=writer.cache_mb,
+                mmap_mb=writer.mmap_mb,
+            )
+            self._reader_conns.append(economy)
+        return economy
+
+    def _shard(self, user_id: int) -> int:
+        return shard_of(user_id, self.shards)
+
+    async def _run(self, executor, func, *args):
+        loop = asyncio.get_running_loop()
+        return await self._retry(
+            lambda: loop.run_in_executor(executor, partial(func, *args))
+        )
+
+    async def _retry(self, call: Callable[[], Awaitable]):
+        """Awaits call() again with exponential backoff for as long as the
+        database is locked, up to ``retries`` times"""
+        delay = self.delay
+        for attempt in range(self.retries):
+            try:
+                return await call()
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                self.counters["lock_waits"] += 1
+                if attempt + 1 < self.retries:
+                    self.counters["retries"] += 1
+                    self.counters["lock_wait_seconds"] += delay
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        raise sqlite3.OperationalError("Database is locked")
+
+    async def _write(self, shard: int, name: str, *args):
+        self.counters["writes"] += 1
+        return await self._run(
+            self._writers[shard], getattr(self._economies[shard], name), *args
+        )
+
+    async def _write_all(self, name: str, *args) -> list:
+        return await asyncio.gather(
+            *(self._write(shard, name, *args) for shard in range(self.shards))
+        )
+
+    async def _read(self, shard: int, name: str, *args):
+        return await self._read_with(
+            shard, lambda economy: getattr(economy, name)(*args)
+        )
+
+    async def _read_all(self, name: str, *args) -> list:
+        return await asyncio.gather(
+            *(self._read(shard, name, *args) for shard in range(self.shards))
+        )
+
+    async def _read_with(self, shard: int, func: Callable[[Economy], object]):
+        """Runs func with a reader thread's connection to the shard"""
+        self.counters["reads"] += 1
+        if not self._economies[shard].concurrent_reads:
+            return await self._run(
+                self._writers[shard], lambda: func(self._economies[shard])
+            )
+        return await self._run(self._readers, lambda: func(self._reader(shard)))
+
+    async def _write_entries(self, entries: List[Entry], ledger_rows) -> None:
+        """Writes a flush to whichever shards it touches"""
+        entries = partition(entries, self.shards)
+        ledger_rows = partition(ledger_rows, self.shards, lambda row: row[1])
+        batches = {
+            shard: (entries.get(shard, []), ledger_rows.get(shard, []))
+            for shard in entries.keys() | ledger_rows.keys()
+        }
+        if len(batches) == 1:
+            [(shard, batch)] = batches.items()
+            await self._write(shard, "write_entries", *batch)
+        elif batches:
+            await self._write_together(batches)
+
+    async def _write_together(self, batches: Dict[int, tuple]) -> None:
+        """Stages a batch on every shard and only commits once all of them
+        have succeeded, so a transfer between shards lands on both or
+        neither. The jobs are queued on every writer in the same order, so
+        two of these can never wait on each other.
+
+        A writer that stays busy past the barrier's timeout counts as a
+        locked database, and the whole batch is retried like any write."""
+        self.counters["writes"] += len(batches)
+        loop = asyncio.get_running_loop()
+
+        async def attempt():
+            barrier = threading.Barrier(len(batches), timeout=self.timeout * 4)
+            errors = []
+
+            def stage(shard: int, entries, ledger_rows):
+                economy = self._economies[shard]
+                try:
+                    economy.stage_entries(entries, ledger_rows)
+                except Exception as e:
+                    errors.append(e)
+                try:
+                    barrier.wait()
+                except threading.BrokenBarrierError:
+                    errors.append(
+                        sqlite3.OperationalError(
+                            f"database is locked: shard {shard} waited too long "
+                            "for the other shards"
+                        )
+                    )
+                if errors:
+                    economy.conn.rollback()
+                else:
+                    economy.conn.commit()
+
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(self._writers[shard], stage, shard, *batch)
+                    for shard, batch in batches.items()
+                )
+            )
+            if errors:
+                raise errors[0]
+
+        await self._retry(attempt)
+
+    @staticmethod
+    def _merge_top(results: List[List[Entry]], n: int, column: str) -> List[Entry]:
+        """Combines each shard's top n into the overall top n"""
+        index = 1 if column == "money" else 2
+        merged = heapq.merge(*results, key=lambda entry: entry[index], reverse=True)
+        return list(islice(merged, n or None))
+
+    def stats(self) -> Dict[str, float]:
+        """Snapshot of the database, lock contention and cache counters"""
+        file_sizes = [economy.file_sizes() for economy in self._economies]
+        return dict(
+            self.counters,
+            cached=len(self.cache),
+            dirty=self.cache.dirty,
+            shards=self.shards,
+            db_bytes=sum(sizes[0] for sizes in file_sizes),
+            wal_bytes=sum(sizes[1] for sizes in file_sizes),
+        )
+
+    async def _cached(self, user_id: int) -> None:
+        """Makes sure the account is in the cache"""
+        if user_id in self.cache:
+            self.counters["cache_hits"] += 1
+            return
+        # Concurrent misses for the same account share a single read
+        loading = self._loading.get(user_id)
+        if loading is None:
+            self.counters["cache_misses"] += 1
+            loading = self._loading[user_id] = asyncio.ensure_future(
+                self._load(user_id)
+            )
+            loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        await asyncio.shield(loading)
+
+    async def _load(self, user_id: int) -> None:
+        entry = await self._read(self._shard(user_id), "find_entry", user_id)
+        # Never overwrite newer in-memory state with what was just read
+        if user_id in self.cache:
+            return
+        if entry:
+            self.cache.load(entry)
+        else:
+            self._track(self.cache.new_entry(user_id))
+            await self._changed()
+
+    async def _mutate(
+        self,
+        name: str,
+        user_id: int,
+        *args,
+        game: Optional[str] = None,
+        reason: Optional[str] = None,
+    ) -> Optional[Entry]:
+        """Applies a change to the cached account and records it.
+
+        Without a flush_interval the change is committed before returning."""
+        await self._cached(user_id)
+        before = self.cache.get_entry(user_id)
+        entry = getattr(self.cache, name)(user_id, *args)
+        if entry:
+            self._track(entry)
+            delta_money, delta_credits = entry[1] - before[1], entry[2] - before[2]
+            if delta_money or delta_credits:
+                self._ledger.append(
+                    (time.time(), user_id, game, delta_money, delta_credits, reason)
+                )
+        await self._changed()
+        return entry
+
+    def _track(self, entry: Entry) -> None:
+        """Keeps the leaderboard and sampler in step with a changed account"""
+        self.leaderboard.update(entry)
+        self.sampler.update(entry[0], entry[1])
+
+    async def _changed(self) -> None:
+        if not self.flush_interval:
+            await self.flush()
+            return
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+            self._flusher.add_done_callback(self._flusher_done)
+        if self.cache.dirty >= self.flush_threshold:
+            self._flush_now.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # The changes stay dirty and go out with the next flush
+                print(f"Failed to flush the economy cache: {e!r}")
+
+    def _flusher_done(self, task: asyncio.Task) -> None:
+        """Lets _changed() start a new flush loop if this one ever ends"""
+        if self._flusher is task:
+            self._flusher = None
+
+    async def flush(self) -> None:
+        """Writes every changed account and its ledger rows in a single
+        transaction per shard, then takes a snapshot if one is due"""
+        async with self._flush_lock:
+            await self._flush()
+        if (
+            self.snapshot_interval
+            and time.monotonic() - self._snapshot_at >= self.snapshot_interval
+        ):
+            self._snapshot_at = time.monotonic()
+            await self.snapshot()
+
+    async def _flush(self) -> None:
+        """flush() without the snapshot; the caller holds _flush_lock"""
+        entries = self.cache.drain()
+        ledger_rows, self._ledger = self._ledger, []
+        if entries or ledger_rows:
+            try:
+                await self._write_entries(entries, ledger_rows)
+            except Exception:
+                self.cache.mark_dirty(entry[0] for entry in entries)
+                self._ledger[:0] = ledger_rows
+                raise
+            self.counters["flushes"] += 1
+            self.counters["flushed_rows"] += len(entries)
+            self.counters["ledger_rows"] += len(ledger_rows)
+
+    async def snapshot(self) -> int:
+        """Records every balance so a rebuild only replays later ledger rows"""
+        async with self._flush_lock:
+            await self._flush()
+            self.counters["snapshots"] += 1
+            return max(await self._write_all("snapshot"))
+
+    async def checkpoint(self, mode: str = "PASSIVE") -> None:
+        """Checkpoints the WAL of every shard, on its writer"""
+        for _, _, pages in await self._write_all("checkpoint", mode):
+            self.counters["checkpoints"] += 1
+            self.counters["checkpointed_pages"] += max(pages, 0)
+
+    async def optimize(self) -> None:
+        await self._write_all("optimize")
+        self.counters["optimizes"] += 1
+
+    async def audit(self, limit: int = 10) -> List[ledger.Mismatch]:
+        """Accounts whose balance doesn't match the snapshot plus ledger"""
+        await self.flush()
+        mismatches = chain.from_iterable(await self._read_all("audit", limit))
+        return list(islice(mismatches, limit or None))
+
+    async def close(self):
+        """Flushes the cache, closes every connection and stops the threads"""
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        self._readers.shutdown()
+        for economy in self._reader_conns:
+            economy.conn.close()
+        for writer, economy in zip(self._writers, self._economies):
+            writer.submit(economy.close).result()
+            writer.shutdown()
+        for file in self._pid_files:
+            file.unlink(missing_ok=True)
+
+    async def get_entry(self, user_id: int) -> Tuple[int, int, int, int]:
+        await self._cached(user_id)
+        return self.cache.get_entry(user_id)
+
+    async def new_entry(self, user_id: int) -> Entry:
+        return await self.get_entry(user_id)
+
+    async def remove_entry(self, user_id: int) -> None:
+        """Deletes the account on its shard's writer, after any flush under
+        way, then forgets everything still held for it in memory"""
+        async with self._flush_lock:
+            await self._write(self._shard(user_id), "remove_entry", user_id)
+            # A read that started before the delete landed would put the
+            # account back in the cache
+            loading = self._loading.get(user_id)
+            if loading:
+                await asyncio.gather(loading, return_exceptions=True)
+            self.cache.remove_entry(user_id)
+            self._ledger = [row for row in self._ledger if row[1] != user_id]
+        self.leaderboard.remove(user_id)
+        self.sampler.remove(user_id)
+
+    async def set_money(
+        self, user_id: int, money: int, game: str = None, reason: str = "set"
+    ) -> Entry:
+        return await self._mutate("set_money", user_id, money, game=game, reason=reason)
+
+    async def set_credits(
+        self, user_id: int, credits: int, game: str = None, reason: str = "set"
+    ) -> Entry:
+        return await self._mutate(
+            "set_credits", user_id, credits, game=game, reason=reason
+        )
+
+    async def add_money(
+        self, user_id: int, money_to_add: int, game: str = None, reason: str = None
+    ) -> Entry:
+        return await self._mutate(
+            "add_money", user_id, money_to_add, game=game, reason=reason
+        )
+
+    async def add_credits(
+        self, user_id: int, credits_to_add: int, game: str = None, reason: str = None
+    ) -> Entry:
+        return await self._mutate(
+            "add_credits", user_id, credits_to_add, game=game, reason=reason
+        )
+
+    async def settle_bet(
+        self,
+        user_id: int,
+        bet: int,
+        delta: int,
+        column: str = "money",
+        game: str = None,
+        reason: str = "bet",
+    ) -> Optional[Entry]:
+        return await self._mutate(
+            "settle_bet", user_id, bet, delta, column, game=game, reason=reason
+        )
+
+    async def transfer(
+        self, legs: List[Leg], game: str = None, reason: str = None
+    ) -> Optional[List[Entry]]:
+        """Applies (user_id, money, credits, kidneys) deltas to any number of
+        accounts at once, or to none of them if a balance would go negative.
+
+        Returns the changed entries in order of first appearance, or None
+        when the transfer was refused."""
+        return (await self.transfer_many([legs], game, reason))[0]
+
+    async def transfer_many(
+        self, transfers: List[List[Leg]], game: str = None, reason: str = None
+    ) -> List[Optional[List[Entry]]]:
+        """Applies a batch of independent transfers with a single commit"""
+        transfers = [list(legs) for legs in transfers]
+        await asyncio.gather(
+            *map(self._cached, {leg[0] for legs in transfers for leg in legs})
+        )
+        results = []
+        for legs in transfers:
+            entries = self.cache.transfer(legs)
+            results.append(entries)
+            if entries is None:
+                continue
+            for entry in entries:
+                self._track(entry)
+            now = time.time()
+            self._ledger.extend(
+                (now, user_id, game, money, credits, reason)
+                for user_id, (money, credits, _) in combine_legs(legs).items()
+                if money or credits
+            )
+        await self._changed()
+        return results
+
+    async def exchange(
+        self, user_id: int, money: int, credits: int, reason: str = None
+    ) -> Optional[Entry]:
+        """Trades money for credits or back in one step, or returns None if
+        the user can't afford their side"""
+        entries = await self.transfer([(user_id, money, credits, 0)], reason=reason)
+        return entries[0] if entries else None
+
+    async def export_entries(self, path: str) -> int:
+        """Streams every account to a CSV or JSONL file, in user_id order"""
+        await self.flush()
+        if self.shards == 1:
+            return await self._read_with(
+                0, lambda economy: bulk.write_entries(path, economy.entries())
+            )
+        return await self._run(
+            self._readers,
+            lambda: bulk.write_entries(
+                path,
+                heapq.merge(*(self._reader(i).entries() for i in range(self.shards))),
+            ),
         )
-        return self.get_entry(user_id)
+
+    async def import_entries(
+        self,
+        entries: Iterable[Entry],
+        chunk_size: int = bulk.CHUNK_SIZE,
+        progress: Callable[[int], object] = None,
+    ) -> int:
+        """Upserts accounts a chunk per transaction, so live writes queue
+        behind at most one chunk, and then takes a snapshot"""
+        await self.flush()
+        rows = 0
+        chunks = bulk.chunked(entries, chunk_size)
+        while chunk := await asyncio.to_thread(next, chunks, None):
+            await asyncio.gather(
+                *(
+                    self._write(shard, "write_entries", rows)
+                    for shard, rows in partition(chunk, self.shards).items()
+                )
+            )
+            # Cached copies win over the database, so they take the imported
+            # values too, once any reads already under way have landed
+            user_ids = [entry[0] for entry in chunk]
+            loading = [self._loading[u] for u in user_ids if u in self._loading]
+            await asyncio.gather(*loading, return_exceptions=True)
+            for entry in chunk:
+                if entry[0] in self.cache:
+                    self.cache.load(entry)
+                    self.cache.mark_dirty([entry[0]])
+                self._track(entry)
+            rows += len(chunk)
+            if progress:
+                progress(rows)
+        await self.snapshot()
+        return rows
+
+    async def random_entry(self, weighted: bool = False) -> Optional[Entry]:
+        """A uniformly random account, or one picked with odds by balance"""
+        await self._load_sampler()
+        user_id = self.sampler.choice(weighted)
+        return None if user_id is None else await self.get_entry(user_id)
+
+    async def random_entries(self, k: int, weighted: bool = False) -> List[Entry]:
+        """Up to k distinct random accounts"""
+        await self._load_sampler()
+        return list(
+            await asyncio.gather(*map(self.get_entry, self.sampler.sample(k, weighted)))
+        )
+
+    async def _load_sampler(self) -> None:
+        """Reads every account id and balance once, the first time it's needed"""
+        async with self._sampler_lock:
+            if self.sampler.loaded:
+                return
+            self.sampler.begin_load()
+            try:
+                await self.flush()
+                # Each shard is read on its writer, behind the flush above
+                sampler = AccountSampler([])
+                for writer, economy in zip(self._writers, self._economies):
+                    await self._run(
+                        writer, lambda e=economy: sampler.extend(e.balances())
+                    )
+            except Exception:
+                self.sampler.cancel_load()
+                raise
+            self.sampler.load(sampler)
+
+    async def top_entries(self, n: int = 0, column: str = "money") -> List[Entry]:
+        if column == "money" and 0 < n <= self.leaderboard.size:
+            async with self._refill_lock:
+                if self.leaderboard.stale:
+                    await self._refill_leaderboard()
+            return self.leaderboard.top(n)
+        await self.flush()
+        return self._merge_top(
+            await self._read_all("top_entries", n, column), n, column
+        )
+
+    async def _refill_leaderboard(self) -> None:
+        """Reloads the in-memory leaderboard from the money index"""
+        self.counters["leaderboard_refills"] += 1
+        self.leaderboard.begin_refill()
+        try:
+            await self.flush()
+            # Queued on the writer behind the flush, so it sees every change
+            # made before begin_refill; later ones are replayed by load().
+            capacity = self.leaderboard.capacity
+            entries = await self._write_all("top_entries", capacity)
+        except Exception:
+            self.leaderboard.cancel_refill()
+            raise
+        self.leaderboard.load(self._merge_top(entries, capacity, "money"))
+
+    async def remove_kidney(self, user_id: int) -> Entry:
+        entries = await self.transfer([(user_id, 10000, 0, -1)], reason="kidney")
+        return entries[0] if entries else await self.get_entry(user_id)
+
+    async def set_kidneys(self, user_id: int, kidneys: int) -> Entry:
+        return await self._mutate("set_kidneys", user_id, kidneys)
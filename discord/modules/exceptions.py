@@ -3,3 +3,7 @@ from discord.ext import commands
 
 class ActiveGameError(commands.CheckFailure):
     pass
+
+
+class RenderQueueFull(commands.CommandError):
+    """Raised instead of starting a game while the render queue is full"""
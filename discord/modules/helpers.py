@@ -24,7 +24,8 @@ with open(
     "r",
     encoding="utf-8",
 ) as f:
-    config = yaml.safe_load(f.read()).get("bot", {})
+    settings = yaml.safe_load(f.read())
+    config = settings.get("bot", {})
 
 TOKEN = config.get("token")
 PREFIX = config.get("prefix", "$")
@@ -32,6 +33,12 @@ OWNER_IDS = config.get("owner_ids")
 DEFAULT_BET = config.get("default_bet", 100)
 B_MULT = config.get("bonus_multiplier", 5)
 B_COOLDOWN = config.get("bonus_cooldown", 12)
+ECONOMY_CONFIG = settings.get("economy") or {}
+MAINTENANCE_CONFIG = settings.get("maintenance") or {}
+SLOTS_CONFIG = settings.get("slots") or {}
+RENDER_CONFIG = settings.get("render") or {}
+BLACKJACK_CONFIG = settings.get("blackjack") or {}
+OUTBOX_CONFIG = settings.get("outbox") or {}
 
 
 def make_embed(
@@ -59,3 +66,14 @@ def make_embed(
     else:
         embed.set_footer(text=datetime.now().strftime("%m/%d/%Y %H:%M:%S"))
     return embed
+
+
+def make_stats_embed(title: str, stats: dict) -> Embed:
+    """One field per counter, for the owner-only stats commands"""
+    embed = make_embed(title=title, footer=None)
+    for name, value in stats.items():
+        embed.add_field(
+            name=name,
+            value=f"{value:,.2f}" if isinstance(value, float) else f"{value:,}",
+        )
+    return embed
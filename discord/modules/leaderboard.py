@@ -0,0 +1,75 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+Entry = Tuple[int, int, int, int]
+
+
+class Leaderboard:
+    """The richest accounts, kept sorted in memory as balances change.
+
+    Holds up to ``capacity`` entries ordered by money. Every account that is
+    not held has at most ``bound`` money, so the held rows are always the
+    true top of the table and reads never touch the database. When too many
+    leaders drop out the board has to be refilled from the money index."""
+
+    def __init__(self, size: int = 10):
+        self.size = size
+        self.capacity = size * 2
+        self._keys: List[Tuple[int, int]] = []  # (-money, user_id), sorted
+        self._entries: Dict[int, Entry] = {}
+        self._pending: Optional[List[Entry]] = None
+        self.bound = None  # None until loaded; -1 means every account is held
+
+    @property
+    def stale(self) -> bool:
+        """Whether the board can't currently answer top(size)"""
+        return self.bound is None or (self.bound >= 0 and len(self._keys) < self.size)
+
+    def load(self, entries: List[Entry]) -> None:
+        """Replaces the board with the top ``capacity`` rows of the table"""
+        self._keys = [(-entry[1], entry[0]) for entry in entries]
+        self._keys.sort()
+        self._entries = {entry[0]: entry for entry in entries}
+        self.bound = entries[-1][1] if len(entries) >= self.capacity else -1
+        pending, self._pending = self._pending, None
+        for entry in pending or ():
+            self.update(entry)
+
+    def begin_refill(self) -> None:
+        """Buffers updates made while a refill query is running"""
+        self._pending = []
+
+    def cancel_refill(self) -> None:
+        self._pending = None
+
+    def update(self, entry: Entry) -> None:
+        """Records an account's new balance"""
+        if self._pending is not None:
+            self._pending.append(entry)
+        if self.bound is None:
+            return
+        user_id, money = entry[0], entry[1]
+        if user_id in self._entries:
+            self._remove(user_id)
+        if money <= self.bound:
+            return
+        bisect.insort(self._keys, (-money, user_id))
+        self._entries[user_id] = entry
+        if len(self._keys) > self.capacity:
+            dropped_money, dropped_id = self._keys.pop()
+            del self._entries[dropped_id]
+            self.bound = max(self.bound, -dropped_money)
+
+    def remove(self, user_id: int) -> None:
+        if self._pending is not None:
+            self._pending.append((user_id, -1, 0, 0))
+        if user_id in self._entries:
+            self._remove(user_id)
+
+    def _remove(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id)
+        index = bisect.bisect_left(self._keys, (-entry[1], user_id))
+        del self._keys[index]
+
+    def top(self, n: int) -> List[Entry]:
+        return [self._entries[user_id] for _, user_id in self._keys[:n]]
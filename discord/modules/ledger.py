@@ -0,0 +1,204 @@
+"""Append-only history of every balance change, plus periodic snapshots.
+
+Balances can be rebuilt from the newest snapshot and the ledger rows after
+it. Rebuilding and auditing run as single SQL statements whose results are
+streamed off the cursor, so memory stays flat however long the ledger is.
+
+Run from the discord/ folder:
+
+    python -m modules.ledger audit|rebuild|snapshot [database]
+
+Without a database file, the command runs on every shard set up under
+economy: in config.yml.
+"""
+import sqlite3
+import sys
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+LedgerRow = Tuple[float, int, Optional[str], int, int, Optional[str]]
+Mismatch = Tuple[int, int, int, int, int]
+
+# Expected balances: the newest snapshot plus every later ledger row
+EXPECTED = """SELECT user_id, sum(money) AS money, sum(credits) AS credits FROM (
+    SELECT user_id, money, credits FROM snapshot_balances
+    WHERE snapshot_id = :snapshot_id
+    UNION ALL
+    SELECT user_id, delta_money, delta_credits FROM ledger
+    WHERE id > :ledger_id
+) GROUP BY user_id"""
+
+
+def create_tables(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS ledger (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        user_id INTEGER NOT NULL,
+        game TEXT,
+        delta_money INTEGER NOT NULL DEFAULT 0,
+        delta_credits INTEGER NOT NULL DEFAULT 0,
+        reason TEXT
+    )"""
+    )
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        ledger_id INTEGER NOT NULL
+    )"""
+    )
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS snapshot_balances (
+        snapshot_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        money INTEGER NOT NULL,
+        credits INTEGER NOT NULL,
+        PRIMARY KEY (snapshot_id, user_id)
+    ) WITHOUT ROWID"""
+    )
+
+
+def baseline(conn: sqlite3.Connection, chunk_size: int = 10000) -> None:
+    """Makes the balances from before the ledger existed the first snapshot.
+
+    Runs after the schema transaction has committed, and copies the
+    accounts chunk_size at a time in user_id order, committing each chunk,
+    so no write waits on the whole table. The newest ledger id is stored in
+    baseline_copy before the first chunk, and each chunk takes off what the
+    ledger rows after it changed, so writes landing between chunks are
+    replayed exactly once. The snapshot only counts once its snapshots row
+    is added at the end; an interrupted copy picks up after the last
+    account it got to, against the same ledger id."""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM snapshots LIMIT 1")
+    if cur.fetchone():
+        return
+    cur.execute("CREATE TABLE IF NOT EXISTS baseline_copy (ledger_id INTEGER NOT NULL)")
+    cur.execute("SELECT ledger_id FROM baseline_copy")
+    row = cur.fetchone()
+    if row is None:
+        # Rows copied without a stored ledger id can't be trusted
+        cur.execute("DELETE FROM snapshot_balances WHERE snapshot_id = 1")
+        cur.execute("INSERT INTO baseline_copy SELECT coalesce(max(id), 0) FROM ledger")
+        conn.commit()
+        cur.execute("SELECT ledger_id FROM baseline_copy")
+        row = cur.fetchone()
+    (ledger_id,) = row
+    while True:
+        cur.execute("SELECT max(user_id) FROM snapshot_balances WHERE snapshot_id = 1")
+        (last,) = cur.fetchone()
+        cur.execute(
+            """INSERT INTO snapshot_balances(snapshot_id, user_id, money, credits)
+            SELECT 1, e.user_id,
+            e.money - coalesce(sum(l.delta_money), 0),
+            e.credits - coalesce(sum(l.delta_credits), 0)
+            FROM economy e
+            LEFT JOIN ledger l ON l.user_id = e.user_id AND l.id > :ledger_id
+            WHERE e.user_id > coalesce(:last, -9223372036854775808)
+            GROUP BY e.user_id ORDER BY e.user_id LIMIT :limit""",
+            {"ledger_id": ledger_id, "last": last, "limit": chunk_size},
+        )
+        copied = cur.rowcount
+        conn.commit()
+        if copied < chunk_size:
+            break
+    cur.execute(
+        "INSERT INTO snapshots(id, ts, ledger_id) VALUES(1, ?, ?)",
+        (time.time(), ledger_id),
+    )
+    cur.execute("DROP TABLE baseline_copy")
+    conn.commit()
+
+
+def append(cur: sqlite3.Cursor, rows: Iterable[LedgerRow]) -> None:
+    cur.executemany(
+        """INSERT INTO ledger(ts, user_id, game, delta_money, delta_credits, reason)
+        VALUES(?,?,?,?,?,?)""",
+        rows,
+    )
+
+
+def latest_snapshot(cur: sqlite3.Cursor) -> Tuple[int, int]:
+    """(snapshot_id, ledger_id) of the newest snapshot"""
+    cur.execute("SELECT id, ledger_id FROM snapshots ORDER BY id DESC LIMIT 1")
+    return cur.fetchone() or (0, 0)
+
+
+def snapshot(cur: sqlite3.Cursor, keep: int = 2) -> int:
+    """Copies every balance into a new snapshot, dropping all but the last
+    ``keep``. Must run in the same transaction as the writes it covers."""
+    cur.execute(
+        """INSERT INTO snapshots(ts, ledger_id)
+        VALUES(?, (SELECT coalesce(max(id), 0) FROM ledger))""",
+        (time.time(),),
+    )
+    snapshot_id = cur.lastrowid
+    cur.execute(
+        """INSERT INTO snapshot_balances(snapshot_id, user_id, money, credits)
+        SELECT ?, user_id, money, credits FROM economy""",
+        (snapshot_id,),
+    )
+    cur.execute(
+        "DELETE FROM snapshot_balances WHERE snapshot_id <= ?",
+        (snapshot_id - keep,),
+    )
+    cur.execute("DELETE FROM snapshots WHERE id <= ?", (snapshot_id - keep,))
+    return snapshot_id
+
+
+def rebuild(cur: sqlite3.Cursor) -> int:
+    """Rewrites money and credits from the snapshot and ledger tail"""
+    snapshot_id, ledger_id = latest_snapshot(cur)
+    cur.execute(
+        f"""INSERT INTO economy(user_id, money, credits)
+        SELECT user_id, money, credits FROM ({EXPECTED}) WHERE true
+        ON CONFLICT(user_id) DO UPDATE SET
+        money = excluded.money, credits = excluded.credits""",
+        {"snapshot_id": snapshot_id, "ledger_id": ledger_id},
+    )
+    return cur.rowcount
+
+
+def audit(cur: sqlite3.Cursor) -> Iterator[Mismatch]:
+    """Yields (user_id, expected money, money, expected credits, credits) for
+    every account that doesn't match the snapshot plus ledger tail"""
+    snapshot_id, ledger_id = latest_snapshot(cur)
+    cur.execute(
+        f"""SELECT e.user_id, coalesce(x.money, 0), e.money,
+        coalesce(x.credits, 0), e.credits
+        FROM economy e LEFT JOIN ({EXPECTED}) x ON x.user_id = e.user_id
+        WHERE coalesce(x.money, 0) != e.money
+        OR coalesce(x.credits, 0) != e.credits""",
+        {"snapshot_id": snapshot_id, "ledger_id": ledger_id},
+    )
+    yield from cur
+
+
+def main(command: str, path: str = None):
+    if command not in ("audit", "rebuild", "snapshot"):
+        raise SystemExit(f"Unknown command {command}")
+    if path:
+        paths = [path]
+    else:
+        from modules.economy import configured_paths
+
+        paths = configured_paths()
+    for path in paths:
+        conn = sqlite3.connect(path)
+        cur = conn.cursor()
+        if command == "audit":
+            mismatches = 0
+            for mismatches, row in enumerate(audit(cur), 1):
+                print("user {} money {}/{} credits {}/{}".format(*row))
+            print(f"{path}: {mismatches} mismatched accounts")
+        elif command == "rebuild":
+            print(f"{path}: rebuilt {rebuild(cur)} accounts")
+        else:
+            print(f"{path}: took snapshot {snapshot(cur)}")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from typing import Optional
+
+from modules.economy import AsyncEconomy
+
+
+class Maintenance:
+    """Background upkeep for the economy database.
+
+    Every ``interval`` seconds the WAL is checkpointed: PASSIVE while the
+    bot is writing, TRUNCATE once a whole interval has gone by without a
+    write, so the WAL file shrinks back during quiet spells instead of
+    growing for good. At most every ``optimize_interval`` seconds, again at
+    a quiet moment, PRAGMA optimize refreshes the planner statistics.
+
+    Started from the bot's setup_hook and stopped before the economy is
+    closed on shutdown."""
+
+    def __init__(
+        self,
+        economy: AsyncEconomy,
+        interval: float = 60,
+        optimize_interval: float = 6 * 3600,
+    ):
+        self.economy = economy
+        self.interval = interval
+        self.optimize_interval = optimize_interval
+        self._writes = None
+        self._optimized = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+            self._task.add_done_callback(self._done)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception as e:
+                # Tried again next interval
+                print(f"Database maintenance failed: {e!r}")
+
+    def _done(self, task: asyncio.Task) -> None:
+        """Reports the loop ending other than by stop(), and lets start() run
+        a new one"""
+        if self._task is task:
+            self._task = None
+        if not task.cancelled() and task.exception():
+            print(f"Database maintenance stopped: {task.exception()!r}")
+
+    async def run(self) -> None:
+        """One round of upkeep"""
+        quiet = (
+            self.economy.counters["writes"] == self._writes
+            and not self.economy.cache.dirty
+        )
+        await self.economy.checkpoint("TRUNCATE" if quiet else "PASSIVE")
+        if quiet and time.monotonic() - self._optimized >= self.optimize_interval:
+            self._optimized = time.monotonic()
+            await self.economy.optimize()
+        # Our own upkeep goes through the writers too, so it isn't counted
+        self._writes = self.economy.counters["writes"]
@@ -0,0 +1,239 @@
+import heapq
+import random
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from modules.cache import Leg, combine_legs
+from modules.ledger import LedgerRow, Mismatch
+
+Entry = Tuple[int, int, int, int]
+
+COLUMNS = {"money": 0, "credits": 1, "kidneys": 2}
+
+
+class MemoryEconomy:
+    """Storage backend that keeps the economy in plain dicts and lists.
+
+    Has the same methods as the SQLite Economy, ledger and snapshots
+    included, but never touches the disk and forgets everything when the
+    process exits. Meant for benchmarks, tests and throwaway staging bots.
+
+    Nothing is locked, so every call has to come from one thread; see
+    ``concurrent_reads``."""
+
+    # AsyncEconomy sends reads to the writer thread instead of a reader pool
+    concurrent_reads = False
+
+    def __init__(
+        self,
+        timeout: float = 30,
+        readonly: bool = False,
+        path=None,
+        cache_mb: int = 0,
+        mmap_mb: int = 0,
+    ):
+        self.accounts: Dict[int, List[int]] = {}
+        self.ledger: List[LedgerRow] = []
+        # (snapshot_id, ledger length, {user_id: (money, credits)})
+        self.snapshots: List[Tuple[int, int, Dict[int, Tuple[int, int]]]] = []
+        self.snapshot()
+
+    def close(self):
+        pass
+
+    # No files, so there is nothing to maintain
+    def checkpoint(self, mode: str = "PASSIVE") -> Tuple[int, int, int]:
+        return 0, 0, 0
+
+    def optimize(self) -> None:
+        pass
+
+    def file_sizes(self) -> Tuple[int, int]:
+        return 0, 0
+
+    def _entry(self, user_id: int) -> Entry:
+        money, credits, kidneys = self.accounts[user_id]
+        return user_id, money, credits, kidneys
+
+    def find_entry(self, user_id: int) -> Optional[Entry]:
+        if user_id in self.accounts:
+            return self._entry(user_id)
+        return None
+
+    def get_entry(self, user_id: int) -> Entry:
+        return self.new_entry(user_id)
+
+    def new_entry(self, user_id: int) -> Entry:
+        self.accounts.setdefault(user_id, [0, 0, 2])
+        return self._entry(user_id)
+
+    def remove_entry(self, user_id: int) -> None:
+        self.accounts.pop(user_id, None)
+
+    def _set(
+        self,
+        user_id: int,
+        column: str,
+        value: int,
+        game: str = None,
+        reason: str = None,
+    ) -> Entry:
+        """Sets one column, recording the change to money or credits in the
+        ledger"""
+        account = self.new_entry(user_id)[1:]
+        delta = value - account[COLUMNS[column]]
+        self.accounts[user_id][COLUMNS[column]] = value
+        if delta and column != "kidneys":
+            money, credits = (delta, 0) if column == "money" else (0, delta)
+            self.ledger.append((time.time(), user_id, game, money, credits, reason))
+        return self._entry(user_id)
+
+    def set_money(
+        self, user_id: int, money: int, game: str = None, reason: str = "set"
+    ) -> Entry:
+        return self._set(user_id, "money", money, game, reason)
+
+    def set_credits(
+        self, user_id: int, credits: int, game: str = None, reason: str = "set"
+    ) -> Entry:
+        return self._set(user_id, "credits", credits, game, reason)
+
+    def set_kidneys(self, user_id: int, kidneys: int) -> Entry:
+        return self._set(user_id, "kidneys", kidneys)
+
+    def add_money(
+        self, user_id: int, money_to_add: int, game: str = None, reason: str = None
+    ) -> Entry:
+        money = self.new_entry(user_id)[1]
+        return self._set(user_id, "money", max(0, money + money_to_add), game, reason)
+
+    def add_credits(
+        self, user_id: int, credits_to_add: int, game: str = None, reason: str = None
+    ) -> Entry:
+        credits = self.new_entry(user_id)[2]
+        return self._set(
+            user_id, "credits", max(0, credits + credits_to_add), game, reason
+        )
+
+    def settle_bet(
+        self,
+        user_id: int,
+        bet: int,
+        delta: int,
+        column: str = "money",
+        game: str = None,
+        reason: str = "bet",
+    ) -> Optional[Entry]:
+        if column not in ("money", "credits"):
+            raise ValueError(f"Can't bet with {column}")
+        account = self.accounts.get(user_id)
+        if account is None or account[COLUMNS[column]] < bet:
+            return None
+        balance = account[COLUMNS[column]]
+        return self._set(user_id, column, max(0, balance + delta), game, reason)
+
+    def transfer(
+        self, legs: List[Leg], game: str = None, reason: str = None
+    ) -> Optional[List[Entry]]:
+        return self.transfer_many([legs], game, reason)[0]
+
+    def transfer_many(
+        self, transfers: List[List[Leg]], game: str = None, reason: str = None
+    ) -> List[Optional[List[Entry]]]:
+        results = []
+        for legs in transfers:
+            totals = combine_legs(legs)
+            for user_id in totals:
+                self.new_entry(user_id)
+            if any(
+                value + delta < 0
+                for user_id, deltas in totals.items()
+                for value, delta in zip(self.accounts[user_id], deltas)
+            ):
+                results.append(None)
+                continue
+            now = time.time()
+            for user_id, deltas in totals.items():
+                account = self.accounts[user_id]
+                for i, delta in enumerate(deltas):
+                    account[i] += delta
+                if deltas[0] or deltas[1]:
+                    self.ledger.append(
+                        (now, user_id, game, deltas[0], deltas[1], reason)
+                    )
+            results.append([self._entry(user_id) for user_id in totals])
+        return results
+
+    def remove_kidney(self, user_id: int) -> Entry:
+        entries = self.transfer([(user_id, 10000, 0, -1)], reason="kidney")
+        return entries[0] if entries else self.get_entry(user_id)
+
+    def random_entry(self) -> Optional[Entry]:
+        if not self.accounts:
+            return None
+        return self._entry(random.choice(list(self.accounts)))
+
+    def balances(self) -> Iterator[Tuple[int, int]]:
+        return ((user_id, account[0]) for user_id, account in self.accounts.items())
+
+    def entries(self) -> Iterator[Entry]:
+        return map(self._entry, sorted(self.accounts))
+
+    def top_entries(self, n: int = 0, column: str = "money") -> List[Entry]:
+        if column not in ("money", "credits"):
+            raise ValueError(f"Can't rank by {column}")
+        index = COLUMNS[column]
+        key = lambda user_id: self.accounts[user_id][index]
+        if n:
+            user_ids = heapq.nlargest(n, self.accounts, key=key)
+        else:
+            user_ids = sorted(self.accounts, key=key, reverse=True)
+        return list(map(self._entry, user_ids))
+
+    def write_entries(
+        self, entries: Iterable[Entry], ledger_rows: Iterable[LedgerRow] = ()
+    ) -> None:
+        for user_id, *account in entries:
+            self.accounts[user_id] = account
+        self.ledger.extend(ledger_rows)
+
+    def snapshot(self, keep: int = 2) -> int:
+        snapshot_id = self.snapshots[-1][0] + 1 if self.snapshots else 1
+        balances = {
+            user_id: (account[0], account[1])
+            for user_id, account in self.accounts.items()
+        }
+        self.snapshots.append((snapshot_id, len(self.ledger), balances))
+        del self.snapshots[:-keep]
+        return snapshot_id
+
+    def _expected(self) -> Dict[int, List[int]]:
+        """Balances from the newest snapshot plus the ledger rows after it"""
+        _, ledger_id, balances = self.snapshots[-1]
+        expected = {user_id: list(balance) for user_id, balance in balances.items()}
+        for _, user_id, _, money, credits, _ in islice(self.ledger, ledger_id, None):
+            balance = expected.setdefault(user_id, [0, 0])
+            balance[0] += money
+            balance[1] += credits
+        return expected
+
+    def rebuild(self) -> int:
+        expected = self._expected()
+        for user_id, (money, credits) in expected.items():
+            self.new_entry(user_id)
+            self.accounts[user_id][:2] = money, credits
+        return len(expected)
+
+    def audit(self, limit: int = 0) -> List[Mismatch]:
+        expected = self._expected()
+        mismatches = []
+        for user_id, (money, credits, _) in self.accounts.items():
+            expected_money, expected_credits = expected.get(user_id, (0, 0))
+            if (expected_money, expected_credits) != (money, credits):
+                mismatches.append(
+                    (user_id, expected_money, money, expected_credits, credits)
+                )
+                if len(mismatches) == limit:
+                    break
+        return mismatches
@@ -0,0 +1,141 @@
+"""Schema migrations for economy.db, tracked with PRAGMA user_version.
+
+Each migration is a schema step plus optional backfills. The schema steps
+of every pending migration run in a single transaction. Backfills then
+update rows a chunk at a time, each chunk committed on its own, so a big
+table never holds the write lock for long. Backfills that aren't a plain
+UPDATE are functions that do their own chunking and commits. user_version
+is only bumped once everything has finished, so an interrupted run starts
+again from the same migrations; schema steps and backfills must be safe to
+repeat.
+
+Run from the discord/ folder to see or apply the current version of a
+database file, or by default of every shard set up under economy: in
+config.yml:
+
+    python -m modules.migrations [database]
+"""
+import sqlite3
+import sys
+from typing import Callable, List, NamedTuple, Tuple
+
+from modules import ledger
+
+CHUNK_SIZE = 10000
+
+
+class Migration(NamedTuple):
+    schema: Callable[[sqlite3.Cursor], None]
+    # (table, SET clause, WHERE clause) run in chunks after the schema step
+    backfills: Tuple[Tuple[str, str, str], ...] = ()
+    # Called with the connection and chunk size after the backfills above
+    chunked: Tuple[Callable[[sqlite3.Connection, int], None], ...] = ()
+
+
+def _columns(cur: sqlite3.Cursor, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cur.fetchall()]
+
+
+def add_column(cur: sqlite3.Cursor, table: str, column: str, definition: str):
+    """ALTER TABLE ADD COLUMN, skipped if an older version already added it"""
+    if column not in _columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_economy(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS economy (
+        user_id INTEGER NOT NULL PRIMARY KEY,
+        money INTEGER NOT NULL DEFAULT 0,
+        credits INTEGER NOT NULL DEFAULT 0
+    )"""
+    )
+
+
+def add_kidneys(cur: sqlite3.Cursor) -> None:
+    add_column(cur, "economy", "kidneys", "INTEGER NOT NULL DEFAULT 2")
+
+
+def index_balances(cur: sqlite3.Cursor) -> None:
+    cur.execute("CREATE INDEX IF NOT EXISTS economy_money ON economy(money DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS economy_credits ON economy(credits DESC)")
+
+
+# Append only: a database at user_version n has run the first n of these
+MIGRATIONS: List[Migration] = [
+    Migration(create_economy),
+    Migration(add_kidneys, (("economy", "kidneys = 2", "kidneys IS NULL"),)),
+    Migration(index_balances),
+    Migration(ledger.create_tables, chunked=(ledger.baseline,)),
+]
+
+
+def version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def backfill(
+    conn: sqlite3.Connection,
+    table: str,
+    assignments: str,
+    where: str,
+    chunk_size: int = CHUNK_SIZE,
+) -> int:
+    """Updates matching rows chunk_size at a time, committing each chunk"""
+    total = 0
+    while True:
+        cur = conn.execute(
+            f"""UPDATE {table} SET {assignments} WHERE rowid IN (
+            SELECT rowid FROM {table} WHERE {where} LIMIT ?)""",
+            (chunk_size,),
+        )
+        conn.commit()
+        total += cur.rowcount
+        if cur.rowcount < chunk_size:
+            return total
+
+
+def migrate(conn: sqlite3.Connection, chunk_size: int = CHUNK_SIZE) -> int:
+    """Brings the database up to date and returns its version"""
+    current = version(conn)
+    pending = MIGRATIONS[current:]
+    if not pending:
+        return current
+    cur = conn.cursor()
+    try:
+        # DDL doesn't open a transaction by itself
+        cur.execute("BEGIN")
+        for migration in pending:
+            migration.schema(cur)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    for migration in pending:
+        for table, assignments, where in migration.backfills:
+            backfill(conn, table, assignments, where, chunk_size)
+        for run in migration.chunked:
+            run(conn, chunk_size)
+    cur.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    conn.commit()
+    return len(MIGRATIONS)
+
+
+def main(path: str = None):
+    if path:
+        paths = [path]
+    else:
+        from modules.economy import configured_paths
+
+        paths = configured_paths()
+    for path in paths:
+        conn = sqlite3.connect(path)
+        before = version(conn)
+        after = migrate(conn)
+        print(f"{path} is at version {after} (was {before})")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,271 @@
+"""Outgoing game messages, paced to Discord's rate limits.
+
+Discord lets a bot make about five message calls per channel every five
+seconds. Past that, discord.py sleeps out the 429 and retries, so the
+calls of a busy channel back up and each one is still sent in turn,
+however stale it is by then. The Outbox keeps a queue per channel
+instead and paces it itself:
+
+- an edit queued for a message that already has one waiting is merged
+  into it, so the message is edited once, to its latest state
+- final results go ahead of the animation frames and turn prompts
+  waiting in the same channel
+- a channel's calls are held back once its bucket is spent, rather than
+  left to hit the limit
+
+Interaction responses don't count against the channel and keep going
+straight out.
+"""
+import asyncio
+import heapq
+import itertools
+from collections import defaultdict, deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+)
+
+import discord
+from discord.ext import commands
+
+# Queue priorities, lowest first
+FINAL = 0
+FRAME = 1
+
+
+class Job:
+    """One call waiting to go out, and everyone waiting on its result"""
+
+    __slots__ = ("key", "send", "kwargs", "priority", "futures", "queued")
+
+    def __init__(
+        self,
+        key: Hashable,
+        send: Callable[..., Awaitable[Any]],
+        kwargs: Dict[str, Any],
+        priority: int,
+        future: asyncio.Future,
+    ):
+        self.key = key
+        self.send = send
+        self.kwargs = kwargs
+        self.priority = priority
+        self.futures = [future]
+        self.queued = True
+
+
+class Channel:
+    """A channel's waiting calls and when its last ``rate`` calls went out"""
+
+    def __init__(self, rate: int):
+        # (priority, order, job), with a job pushed again when it moves up
+        self.queue: List[Tuple[int, int, Job]] = []
+        # Jobs that can still be coalesced, by key
+        self.pending: Dict[Hashable, Job] = {}
+        self.depth = 0
+        self.sent: Deque[float] = deque(maxlen=rate)
+        self.task: Optional[asyncio.Task] = None
+
+    def pop(self) -> Job:
+        while True:
+            priority, _, job = heapq.heappop(self.queue)
+            if job.queued and priority == job.priority:
+                break
+        job.queued = False
+        self.depth -= 1
+        if job.key is not None:
+            del self.pending[job.key]
+        return job
+
+    def wait(self, per: float, now: float) -> float:
+        """Seconds until the bucket has a call to spare"""
+        if len(self.sent) < self.sent.maxlen:
+            return 0.0
+        return self.sent[0] + per - now
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    # Frames are often left unawaited, and the worker prints their errors
+    if not future.cancelled():
+        future.exception()
+
+
+class Outbox:
+    """Sends and edits messages through one queue per channel, at most
+    ``rate`` calls every ``per`` seconds in each.
+
+    edit() and reply() return a future of the call's result; await it to
+    wait until the message is out. A frame that a later edit may merge into
+    needn't be awaited at all.
+
+    One instance is attached to the bot as ``client.outbox``."""
+
+    def __init__(self, rate: int = 5, per: float = 5.0):
+        self.rate = rate
+        self.per = per
+        self._channels: Dict[int, Channel] = {}
+        self._order = itertools.count()
+        self.counters: Dict[str, float] = defaultdict(int)
+        self.max_depth = 0
+
+    def edit(
+        self, message: discord.Message, final: bool = False, **kwargs
+    ) -> asyncio.Future:
+        """Queues message.edit(**kwargs). If an edit is still waiting for the
+        same message, this one's fields are merged into it, later values
+        winning, and both futures get the result of the one edit sent."""
+        return self.submit(
+            message.channel.id, ("edit", message.id), message.edit, kwargs, final
+        )
+
+    def reply(
+        self, ctx: commands.Context, final: bool = True, **kwargs
+    ) -> asyncio.Future:
+        """Queues ctx.reply(**kwargs), which is never coalesced"""
+        return self.submit(ctx.channel.id, None, ctx.reply, kwargs, final)
+
+    def discard(self, message: discord.Message) -> bool:
+        """Drops the edit waiting for the message, if there is one, for when
+        it has been edited some other way. Its future gets None."""
+        channel = self._channels.get(message.channel.id)
+        job = channel and channel.pending.pop(("edit", message.id), None)
+        if not job:
+            return False
+        job.queued = False
+        channel.depth -= 1
+        self.counters["discarded"] += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_result(None)
+        return True
+
+    def submit(
+        self,
+        channel_id: int,
+        key: Hashable,
+        send: Callable[..., Awaitable[Any]],
+        kwargs: Dict[str, Any],
+        final: bool = True,
+    ) -> asyncio.Future:
+        """Queues send(**kwargs) in the channel. Unless key is None, a call
+        already waiting with the same key takes the new send and kwargs
+        merged over its own instead, since edits only change the fields
+        they are given."""
+        future = asyncio.get_running_loop().create_future()
+        priority = FINAL if final else FRAME
+        if not final:
+            future.add_done_callback(_retrieve)
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = Channel(self.rate)
+
+        job = channel.pending.get(key) if key is not None else None
+        if job:
+            self.counters["coalesced"] += 1
+            job.send = send
+            job.kwargs = {**job.kwargs, **kwargs}
+            job.futures.append(future)
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heappush(channel.queue, (priority, next(self._order), job))
+        else:
+            job = Job(key, send, kwargs, priority, future)
+            if key is not None:
+                channel.pending[key] = job
+            heapq.heappush(channel.queue, (priority, next(self._order), job))
+            channel.depth += 1
+            self.max_depth = max(self.max_depth, channel.depth)
+
+        if channel.task is None:
+            channel.task = asyncio.create_task(self._drain(channel_id, channel))
+        return future
+
+    async def _drain(self, channel_id: int, channel: Channel):
+        loop = asyncio.get_running_loop()
+        try:
+            while channel.depth:
+                delay = channel.wait(self.per, loop.time())
+                if delay > 0:
+                    # Whatever is queued meanwhile can still be coalesced
+                    self.counters["paced"] += 1
+                    self.counters["paced_seconds"] += delay
+                    await asyncio.sleep(delay)
+                    continue
+                job = channel.pop()
+                await self._send(job)
+                channel.sent.append(loop.time())
+            # Only the entries of discarded edits are left
+            channel.queue.clear()
+        finally:
+            channel.task = None
+            loop.call_later(self.per, self._forget, channel_id)
+
+    async def _send(self, job: Job):
+        try:
+            result = await job.send(**job.kwargs)
+        except asyncio.CancelledError:
+            for future in job.futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            self.counters["errors"] += 1
+            if isinstance(e, discord.HTTPException) and e.status == 429:
+                self.counters["rate_limited"] += 1
+            if job.priority == FRAME:
+                print(f"Failed to update a message: {e}")
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.counters["sent"] += 1
+        self.counters["finals_sent" if job.priority == FINAL else "frames_sent"] += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_result(result)
+
+    def _forget(self, channel_id: int):
+        """Drops an idle channel once its bucket has refilled"""
+        channel = self._channels.get(channel_id)
+        if channel is None or channel.task is not None or channel.depth:
+            return
+        loop = asyncio.get_running_loop()
+        wait = channel.sent[-1] + self.per - loop.time() if channel.sent else 0
+        if wait > 0:
+            loop.call_later(wait, self._forget, channel_id)
+        else:
+            del self._channels[channel_id]
+
+    def stats(self) -> Dict[str, float]:
+        depths = [channel.depth for channel in self._channels.values()]
+        return dict(
+            self.counters,
+            channels=len(depths),
+            queued=sum(depths),
+            deepest=max(depths, default=0),
+            max_depth=self.max_depth,
+            rate=self.rate,
+            per=self.per,
+        )
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Gives the queues timeout seconds to empty, then drops what's left"""
+        tasks = [channel.task for channel in self._channels.values() if channel.task]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        for channel in self._channels.values():
+            for _, _, job in channel.queue:
+                for future in job.futures:
+                    future.cancel()
+            channel.queue.clear()
+            channel.pending.clear()
+            channel.depth = 0
@@ -0,0 +1,168 @@
+"""The rules and payouts of every game, as plain functions.
+
+The cogs deal with Discord, bets and the economy; what a round pays is
+decided here, so the payout tables can be read in one place and played
+offline by modules.simulator. Functions that draw randomness take the
+random source as ``rng``, the random module unless given.
+"""
+import bisect
+import random
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from modules.card import ACES, POINTS
+
+Stops = Tuple[int, int, int]
+
+# Slots
+SLOT_WIN_RATE = 12 / 100
+# Cumulative chance out of 100 of each symbol but the last, given a win
+SLOT_SYMBOL_WEIGHTS = [3.5, 7, 15, 25, 55]
+# Credits paid per credit bet when all three reels show the symbol
+SLOT_PAYOUTS = [4, 80, 40, 25, 10, 5]
+SLOT_SYMBOLS = len(SLOT_PAYOUTS)
+
+
+def slot_stops(items: int, rng=random) -> Stops:
+    """Where each reel stops, out of ``items`` positions. One spin in
+    SLOT_WIN_RATE is rigged to line up a symbol drawn by weight."""
+    stops = [rng.randint(1, items - 1) for _ in range(3)]
+    if rng.random() < SLOT_WIN_RATE:
+        x = round(rng.random() * 100, 1)
+        symbol = bisect.bisect(SLOT_SYMBOL_WEIGHTS, x)
+        stops = [
+            symbol + rng.randint(1, items // SLOT_SYMBOLS - 1) * SLOT_SYMBOLS
+            for _ in range(3)
+        ]
+        stops = [stop - SLOT_SYMBOLS if stop == items else stop for stop in stops]
+    return tuple(stops)
+
+
+def slot_symbol(stop: int) -> int:
+    return (1 + stop) % SLOT_SYMBOLS
+
+
+def slot_reward(stops: Stops, bet: int) -> int:
+    """Credits paid out, 0 unless all three reels show the same symbol"""
+    s1, s2, s3 = map(slot_symbol, stops)
+    if s1 == s2 == s3:
+        return SLOT_PAYOUTS[s1] * bet
+    return 0
+
+
+# Roulette
+# fmt: off
+WHEEL = [
+    0, 32, 15, 19, 4, 21, 2, 25, 17, 34, 6, 27, 13, 36, 11, 30, 8, 23, 10,
+    5, 24, 16, 33, 1, 20, 14, 31, 9, 22, 18, 29, 7, 28, 12, 35, 3, 26,
+]
+# fmt: on
+RED = [1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36]
+BLACK = [2, 4, 6, 8, 10, 11, 13, 15, 17, 20, 22, 24, 26, 28, 29, 31, 33, 35]
+ROULETTE_BETS = {
+    "red": RED,
+    "r": RED,
+    "black": BLACK,
+    "b": BLACK,
+    "even": list(range(2, 37, 2)),
+    "e": list(range(2, 37, 2)),
+    "odd": list(range(1, 37, 2)),
+    "o": list(range(1, 37, 2)),
+    "low": list(range(1, 19)),
+    "high": list(range(19, 37)),
+    "l": list(range(1, 19)),
+    "h": list(range(19, 37)),
+}
+# Paid per unit bet on a single number, anything else pays even money
+ROULETTE_NUMBER_PAYOUT = 35
+
+
+def roulette_numbers(choice: str) -> Optional[List[int]]:
+    """The numbers a bet on ``choice`` covers, None if it isn't a bet"""
+    if choice.isdigit():
+        return [int(choice)] if 0 <= int(choice) <= 36 else None
+    return ROULETTE_BETS.get(choice.lower())
+
+
+def roulette_multiplier(choice: str) -> int:
+    return ROULETTE_NUMBER_PAYOUT if choice.isdigit() else 1
+
+
+def spin_wheel(rng=random) -> int:
+    return rng.choice(WHEEL)
+
+
+def roulette_delta(choice: str, result: int, bet: int) -> int:
+    """Balance change for a bet on ``choice`` when the ball lands on result"""
+    if result in roulette_numbers(choice):
+        return bet * roulette_multiplier(choice)
+    return -bet
+
+
+# Coin flip and dice
+COIN = {"h": "Heads", "t": "Tails"}
+# Paid per unit bet on guessing the die right
+ROLL_PAYOUT = 6
+
+
+def flip_coin(rng=random) -> str:
+    return rng.choice(list(COIN))
+
+
+def flip_delta(choice: str, result: str, bet: int) -> int:
+    return bet if choice == result else -bet
+
+
+def roll_die(rng=random) -> int:
+    return rng.choice(range(1, 7))
+
+
+def roll_delta(choice: int, result: int, bet: int) -> int:
+    return bet * ROLL_PAYOUT if choice == result else -bet
+
+
+# Blackjack
+DEALER_STANDS_ON = 17
+
+
+class Outcome(NamedTuple):
+    title: str
+    verb: str
+    # Shown as won/lost/kept, and handed back to the player out of the
+    # held bet plus winnings
+    amount: int
+    payout: int
+
+
+def hand_value(hand: Iterable[int]) -> int:
+    """Total of the cards, ints as in modules.card. Aces count 1, except
+    the first counts 11 while the rest of the hand is at most 10."""
+    total = aces = 0
+    for card in hand:
+        total += POINTS[card]
+        aces += ACES[card]
+    if aces and total - aces <= 10:
+        total += 10
+    return total
+
+
+def player_outcome(score: int, bet: int) -> Optional[Outcome]:
+    """Ends the hand once the player reaches 21 or busts"""
+    if score == 21:
+        amount = int(bet * 1.5)
+        return Outcome("Blackjack!", "won", amount, bet + amount)
+    if score > 21:
+        return Outcome("Player busts", "lost", bet, 0)
+    return None
+
+
+def showdown(player: int, dealer: int, bet: int) -> Outcome:
+    """The player stood on ``player`` and the dealer drew to ``dealer``"""
+    if dealer == 21:
+        return Outcome("Dealer blackjack", "lost", bet, 0)
+    if dealer > 21:
+        return Outcome("Dealer busts", "won", bet, 2 * bet)
+    if dealer == player:
+        return Outcome("Tie!", "kept", bet, bet)
+    if dealer > player:
+        return Outcome("You lose!", "lost", bet, 0)
+    return Outcome("You win!", "won", bet, 2 * bet)
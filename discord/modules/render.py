@@ -0,0 +1,152 @@
+"""Image rendering off the event loop.
+
+Drawing and encoding with PIL is CPU-bound and holds the GIL, so one big
+encode on the event loop stalls every guild. RenderService runs render jobs
+in a pool of worker processes instead, and cogs await the encoded bytes.
+
+A job is a module-level function that takes picklable arguments and
+returns picklable data, usually the encoded image. The jobs for the
+blackjack and roulette tables live here; the slot machine's is
+modules.slot_machine.render_spin.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, TypeVar
+
+from PIL import Image, ImageDraw, ImageFont
+
+from modules.card_atlas import table_renderer
+from modules.exceptions import RenderQueueFull
+
+FOLDER = Path(__file__).parent
+
+T = TypeVar("T")
+
+
+class RenderService:
+    """Runs render jobs in ``workers`` processes, one per core by default.
+
+    At most ``queue_size`` jobs are handed to the pool at once, later ones
+    wait their turn on the event loop. Games call check() before they
+    start, which refuses them with RenderQueueFull once another
+    ``queue_size`` jobs are waiting. Jobs of games already under way are
+    never refused, so those still wait. With workers=0, on platforms that
+    can't fork, or once the pool has broken, jobs run inline in a thread
+    of the bot's own process instead.
+
+    Workers are forked when the service is created, so create it before
+    anything starts threads (the economy does)."""
+
+    def __init__(self, workers: Optional[int] = None, queue_size: int = 64):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            # Spawned workers would import and run bot.py all over again
+            workers = 0
+        self.workers = os.cpu_count() if workers is None else workers
+        self.queue_size = queue_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.workers:
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("fork")
+            )
+            # Forks every worker now rather than on the first job
+            self._pool.submit(int).result()
+        self._slots = asyncio.Semaphore(queue_size)
+        self.waiting = 0
+        self.counters: Dict[str, float] = defaultdict(int)
+
+    def check(self) -> None:
+        """Raises RenderQueueFull if the waiting jobs already fill the queue"""
+        if self.waiting >= self.queue_size:
+            self.counters["refused_games"] += 1
+            raise RenderQueueFull("The bot is busy, try again in a moment.")
+
+    async def run(self, job: Callable[..., T], *args) -> T:
+        """Runs job(*args) in a worker and returns its result, waiting for a
+        slot however long the queue is"""
+        self.waiting += 1
+        async with self._slots:
+            self.waiting -= 1
+            start = time.perf_counter()
+            result = await self._run(job, *args)
+            elapsed = time.perf_counter() - start
+        name = job.__name__
+        self.counters[f"{name}_jobs"] += 1
+        self.counters[f"{name}_seconds"] += elapsed
+        self.counters[f"{name}_max_seconds"] = max(
+            self.counters[f"{name}_max_seconds"], elapsed
+        )
+        return result
+
+    async def _run(self, job: Callable[..., T], *args) -> T:
+        if self._pool:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._pool, job, *args
+                )
+            except BrokenProcessPool:
+                # A worker died; forking a new pool now would copy the
+                # economy's threads mid-flight, so render inline from now on
+                print("Render pool broke, rendering inline instead")
+                self.counters["pool_failures"] += 1
+                self._pool = None
+        self.counters["inline_jobs"] += 1
+        return await asyncio.to_thread(job, *args)
+
+    def stats(self) -> Dict[str, float]:
+        return dict(
+            self.counters,
+            workers=self.workers if self._pool else 0,
+            queue_size=self.queue_size,
+            waiting=self.waiting,
+        )
+
+    def close(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def png(image: Image.Image) -> bytes:
+    with io.BytesIO() as image_binary:
+        image.save(image_binary, format="PNG")
+        return image_binary.getvalue()
+
+
+def blackjack_table(hands: Sequence[Sequence[str]]) -> bytes:
+    """The blackjack table with each hand, given as card image file names,
+    in a centred row"""
+    return png(table_renderer().draw(hands))
+
+
+def roulette_table(result: int) -> bytes:
+    """The roulette table with the winning number written over it"""
+    table = Image.open(FOLDER / "roulette" / "roulette_table.png").convert("RGBA")
+
+    base_image = Image.new("RGBA", table.size, (0, 0, 0, 0))
+    base_image.paste(table, (0, 0))
+
+    draw = ImageDraw.Draw(base_image)
+    font = ImageFont.load_default()
+    text = str(result)
+
+    bbox = draw.textbbox((0, 0), text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    draw.text(
+        (
+            (base_image.width - text_width) / 2,
+            (base_image.height - text_height) / 2,
+        ),
+        text,
+        font=font,
+        fill=(255, 0, 0),
+    )
+    return png(base_image)
@@ -0,0 +1,170 @@
+import random
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class AccountSampler:
+    """Picks random accounts without touching the database.
+
+    Keeps every user_id in a flat array, so a uniform pick is O(1), and each
+    account's balance in a Fenwick tree, so a pick weighted by balance is
+    O(log n). Both are kept current as balances change.
+
+    A sampler made without rows is an empty placeholder that ignores
+    changes until load() gives it the full list of accounts."""
+
+    def __init__(self, rows: Optional[Iterable[Tuple[int, int]]] = None):
+        self.loaded = rows is not None
+        self._pending: Optional[List[Tuple[int, int]]] = None
+        self._index: Dict[int, int] = {}
+        self._ids = array("q")
+        self._weights = array("q")
+        self.extend(rows or ())
+
+    def extend(self, rows: Iterable[Tuple[int, int]]) -> None:
+        """Bulk-adds accounts that aren't held yet, rebuilding the tree once"""
+        for user_id, weight in rows:
+            self._index[user_id] = len(self._ids)
+            self._ids.append(user_id)
+            self._weights.append(weight)
+        self._build(max(16, len(self._ids)))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def total(self) -> int:
+        """Sum of every weight"""
+        return self._prefix(len(self._ids))
+
+    def _build(self, capacity: int) -> None:
+        """Rebuilds the Fenwick tree in O(n) with room for capacity ids"""
+        self._capacity = capacity
+        self._tree = array("q", bytes(8 * (capacity + 1)))
+        self._tree[1 : len(self._weights) + 1] = self._weights
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                self._tree[parent] += self._tree[i]
+        self._top_bit = 1 << (capacity.bit_length() - 1)
+
+    def _add(self, i: int, delta: int) -> None:
+        i += 1
+        while i <= self._capacity:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i: int) -> int:
+        total = 0
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, target: int) -> int:
+        """Index of the account whose weight range contains target"""
+        i = 0
+        bit = self._top_bit
+        while bit:
+            j = i + bit
+            if j <= self._capacity and self._tree[j] <= target:
+                i = j
+                target -= self._tree[j]
+            bit >>= 1
+        return i
+
+    def begin_load(self) -> None:
+        """Buffers changes made while a replacement is being built"""
+        self._pending = []
+
+    def cancel_load(self) -> None:
+        self._pending = None
+
+    def load(self, other: "AccountSampler") -> None:
+        """Takes over the contents of a freshly built sampler"""
+        self._index = other._index
+        self._ids = other._ids
+        self._weights = other._weights
+        self._tree = other._tree
+        self._capacity = other._capacity
+        self._top_bit = other._top_bit
+        self.loaded = True
+        pending, self._pending = self._pending, None
+        for user_id, weight in pending or ():
+            if weight < 0:
+                self.remove(user_id)
+            else:
+                self.update(user_id, weight)
+
+    def update(self, user_id: int, weight: int) -> None:
+        """Adds the account, or changes its weight"""
+        if self._pending is not None:
+            self._pending.append((user_id, weight))
+            return
+        if not self.loaded:
+            return
+        i = self._index.get(user_id)
+        if i is not None:
+            self._add(i, weight - self._weights[i])
+            self._weights[i] = weight
+            return
+        i = len(self._ids)
+        if i == self._capacity:
+            self._build(self._capacity * 2)
+        self._index[user_id] = i
+        self._ids.append(user_id)
+        self._weights.append(0)
+        self._add(i, weight)
+        self._weights[i] = weight
+
+    def remove(self, user_id: int) -> None:
+        if self._pending is not None:
+            self._pending.append((user_id, -1))
+            return
+        i = self._index.pop(user_id, None)
+        if i is None:
+            return
+        # Move the last account into the gap so the arrays stay dense
+        last = len(self._ids) - 1
+        self._add(i, -self._weights[i])
+        if i != last:
+            moved = self._ids[last]
+            self._add(last, -self._weights[last])
+            self._ids[i] = moved
+            self._weights[i] = self._weights[last]
+            self._add(i, self._weights[i])
+            self._index[moved] = i
+        self._ids.pop()
+        self._weights.pop()
+
+    def choice(self, weighted: bool = False) -> Optional[int]:
+        """A random user_id, optionally with odds proportional to weight"""
+        if not self._ids:
+            return None
+        if weighted and self.total > 0:
+            return self._ids[self._find(random.randrange(self.total))]
+        return self._ids[random.randrange(len(self._ids))]
+
+    def sample(self, k: int, weighted: bool = False) -> List[int]:
+        """Up to k distinct user_ids"""
+        k = min(k, len(self._ids))
+        if not weighted:
+            return [self._ids[i] for i in random.sample(range(len(self._ids)), k)]
+        # Draw without replacement by zeroing each pick until all are drawn
+        picked = []
+        for _ in range(k):
+            total = self.total
+            if total <= 0:
+                break
+            i = self._find(random.randrange(total))
+            picked.append(i)
+            self._add(i, -self._weights[i])
+        for i in picked:
+            self._add(i, self._weights[i])
+        user_ids = [self._ids[i] for i in picked]
+        if len(user_ids) < k:
+            # Only zero-weight accounts are left, so fill up uniformly
+            taken = set(user_ids)
+            rest = [u for u in self._ids if u not in taken]
+            user_ids += random.sample(rest, k - len(user_ids))
+        return user_ids
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, List, NamedTuple
+
+from modules.exceptions import ActiveGameError
+
+
+class Session(NamedTuple):
+    user_id: int
+    game: str
+    bet: int
+    started: float
+    lock: asyncio.Lock
+
+
+class SessionRegistry:
+    """Bot-wide record of who is in the middle of a game.
+
+    Each user has one asyncio lock shared by every cog, so a player can only
+    have one game touching their balance at a time. The lock is held for
+    the whole session, and is dropped once nobody holds or waits for it.
+
+    One instance is attached to the bot as ``client.sessions``."""
+
+    def __init__(self):
+        self._sessions: Dict[int, Session] = {}
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def is_busy(self, user_id: int) -> bool:
+        return user_id in self._sessions
+
+    def get(self, user_id: int) -> Session:
+        return self._sessions.get(user_id)
+
+    def all(self) -> List[Session]:
+        """Live sessions, oldest first"""
+        return sorted(self._sessions.values(), key=lambda session: session.started)
+
+    async def start(
+        self, user_id: int, game: str, bet: int = 0, wait: bool = False
+    ) -> Session:
+        """Claims the user for a game. Raises ActiveGameError if they are
+        already playing, unless wait is set. Must be paired with end()."""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        if lock.locked() and not wait:
+            raise ActiveGameError("You have an ongoing game. Please finish it first.")
+        await lock.acquire()
+        session = self._sessions[user_id] = Session(
+            user_id, game, bet, time.time(), lock
+        )
+        return session
+
+    def end(self, user_id: int) -> None:
+        """Releases the user and lets the next waiting game start"""
+        session = self._sessions.pop(user_id, None)
+        if session:
+            session.lock.release()
+
+    @asynccontextmanager
+    async def session(self, user_id: int, game: str, bet: int = 0, wait: bool = False):
+        """start() and end() around a block, however it exits"""
+        session = await self.start(user_id, game, bet, wait)
+        try:
+            yield session
+        finally:
+            self.end(user_id)
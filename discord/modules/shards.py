@@ -0,0 +1,32 @@
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+# Spreads the sequential bits of Discord snowflakes before taking the modulo
+MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def shard_of(user_id: int, shards: int) -> int:
+    """Which of ``shards`` database files holds the account"""
+    if shards == 1:
+        return 0
+    return (((user_id * MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> 32) % shards
+
+
+def shard_paths(path: str, shards: int) -> List[str]:
+    """economy.db stays as is for one shard, else economy.0.db, economy.1.db..."""
+    if shards == 1:
+        return [path]
+    path = Path(path)
+    return [str(path.with_name(f"{path.stem}.{i}{path.suffix}")) for i in range(shards)]
+
+
+def partition(
+    rows: Iterable[T], shards: int, user_id: Callable[[T], int] = lambda row: row[0]
+) -> Dict[int, List[T]]:
+    """Groups rows by the shard of their user_id, leaving out empty shards"""
+    groups: Dict[int, List[T]] = {}
+    for row in rows:
+        groups.setdefault(shard_of(user_id(row), shards), []).append(row)
+    return groups
@@ -0,0 +1,304 @@
+"""Offline house edge of every game.
+
+Plays millions of rounds of each game with NumPy, a whole chunk of
+rounds per array operation, under the rules in modules.outcomes, and
+reports the return to player (RTP), the spread of what a round pays and
+how often each payout comes up. Check a change to the payout tables here
+before deploying it.
+
+Run from the discord/ folder:
+
+    python -m modules.simulator [rounds] [game...]
+
+Games are slots, blackjack, flip, roll and roulette-<choice>, where
+choice is anything the roulette command takes (roulette-red,
+roulette-17). With --check, each game is also played round by round
+through the functions the cogs call, to show the two agree.
+"""
+import random
+import sys
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from modules import outcomes
+from modules.card import ACES, DECK, POINTS, Shoe
+from modules.slot_machine import FOLDER, SlotMachine
+
+# Rounds per array operation, enough to make the Python overhead vanish
+# while a chunk's arrays stay within tens of megabytes
+CHUNK = 1 << 18
+# The player hits below this, like the dealer
+STAND_ON = outcomes.DEALER_STANDS_ON
+# No blackjack round gets this far into the deck: both hands stop at 17
+# or over, and the smallest cards add up to that slowly (four aces, four
+# twos and two threes make 18 in ten cards)
+DEALT = 24
+
+
+def slot_items() -> int:
+    """Stop positions on the reel, read from the art as SlotMachine does"""
+    with Image.open(FOLDER / "slot-reel.png") as reel:
+        return reel.height // 2 // SlotMachine.item
+
+
+# Every game takes a generator and a number of rounds and returns what
+# each round won or lost per unit bet
+def slots(rng: np.random.Generator, rounds: int, items: int = None) -> np.ndarray:
+    items = items or slot_items()
+    stops = rng.integers(1, items, size=(rounds, 3))
+    rigged = rng.random(rounds) < outcomes.SLOT_WIN_RATE
+    wins = int(rigged.sum())
+    x = np.round(rng.random(wins) * 100, 1)
+    symbol = np.searchsorted(outcomes.SLOT_SYMBOL_WEIGHTS, x, side="right")
+    lined_up = symbol[:, None] + outcomes.SLOT_SYMBOLS * rng.integers(
+        1, items // outcomes.SLOT_SYMBOLS, size=(wins, 3)
+    )
+    lined_up[lined_up == items] -= outcomes.SLOT_SYMBOLS
+    stops[rigged] = lined_up
+
+    symbols = (1 + stops) % outcomes.SLOT_SYMBOLS
+    same = (symbols[:, 0] == symbols[:, 1]) & (symbols[:, 1] == symbols[:, 2])
+    payouts = np.array(outcomes.SLOT_PAYOUTS, dtype=np.float64)
+    return np.where(same, payouts[symbols[:, 0]], 0.0) - 1
+
+
+def roulette(choice: str) -> Callable[[np.random.Generator, int], np.ndarray]:
+    numbers = outcomes.roulette_numbers(choice)
+    if numbers is None:
+        raise ValueError(f"{choice} isn't a roulette bet")
+    multiplier = outcomes.roulette_multiplier(choice)
+
+    def play(rng: np.random.Generator, rounds: int) -> np.ndarray:
+        result = rng.choice(outcomes.WHEEL, size=rounds)
+        return np.where(np.isin(result, numbers), multiplier, -1.0)
+
+    return play
+
+
+def flip(rng: np.random.Generator, rounds: int) -> np.ndarray:
+    return np.where(rng.integers(0, 2, size=rounds) == 0, 1.0, -1.0)
+
+
+def roll(rng: np.random.Generator, rounds: int) -> np.ndarray:
+    # Every guess has the same odds, so the player always guesses 1
+    return np.where(rng.integers(1, 7, size=rounds) == 1, outcomes.ROLL_PAYOUT, -1.0)
+
+
+def _hand_value(non_aces: np.ndarray, aces: np.ndarray) -> np.ndarray:
+    """outcomes.hand_value over arrays: the first ace counts 11 while
+    the rest of the hand is at most 10, every other ace 1"""
+    return non_aces + aces + 10 * ((aces > 0) & (non_aces <= 10))
+
+
+def _deal(rng: np.random.Generator, rounds: int) -> np.ndarray:
+    """The top DEALT cards of a shuffled deck per round, by shuffling
+    only as far as that, one column of every round at a time"""
+    deck = np.repeat(np.arange(DECK, dtype=np.int8)[None], rounds, axis=0)
+    rows = np.arange(rounds)
+    for top in range(DEALT):
+        swap = rng.integers(top, len(deck[0]), size=rounds)
+        card = deck[rows, swap]
+        deck[rows, swap] = deck[:, top]
+        deck[:, top] = card
+    return deck[:, :DEALT]
+
+
+def blackjack(rng: np.random.Generator, rounds: int) -> np.ndarray:
+    """The player hits below STAND_ON. Blackjack pays 3:2 before int()
+    rounds the winnings down, as it does on bets of even tens."""
+    deck = _deal(rng, rounds)
+    ace = np.array(ACES, dtype=np.int8)[deck]
+    non_ace = np.array(POINTS, dtype=np.int8)[deck] - ace
+    rows = np.arange(rounds)
+
+    # Dealt player, dealer, player, dealer
+    player = (
+        non_ace[:, [0, 2]].sum(axis=1, dtype=np.int16),
+        ace[:, [0, 2]].sum(axis=1, dtype=np.int16),
+    )
+    dealer = (
+        non_ace[:, [1, 3]].sum(axis=1, dtype=np.int16),
+        ace[:, [1, 3]].sum(axis=1, dtype=np.int16),
+    )
+    drawn = np.full(rounds, 4)
+
+    hitting = np.ones(rounds, dtype=bool)
+    while True:
+        score = _hand_value(*player)
+        hitting &= score < STAND_ON
+        if not hitting.any():
+            break
+        hit = rows[hitting]
+        player[0][hit] += non_ace[hit, drawn[hit]]
+        player[1][hit] += ace[hit, drawn[hit]]
+        drawn[hit] += 1
+
+    net = np.zeros(rounds)
+    net[score == 21] = 1.5
+    net[score > 21] = -1
+    standing = score < 21
+    while True:
+        dealer_score = _hand_value(*dealer)
+        drawing = standing & (dealer_score < outcomes.DEALER_STANDS_ON)
+        if not drawing.any():
+            break
+        draw = rows[drawing]
+        dealer[0][draw] += non_ace[draw, drawn[draw]]
+        dealer[1][draw] += ace[draw, drawn[draw]]
+        drawn[draw] += 1
+
+    # The order of showdown()
+    net[standing] = np.select(
+        [
+            dealer_score[standing] == 21,
+            dealer_score[standing] > 21,
+            dealer_score[standing] == score[standing],
+            dealer_score[standing] > score[standing],
+        ],
+        [-1, 1, 0, -1],
+        default=1,
+    )
+    return net
+
+
+GAMES: Dict[str, Callable[[np.random.Generator, int], np.ndarray]] = {
+    "slots": slots,
+    "blackjack": blackjack,
+    "flip": flip,
+    "roll": roll,
+    "roulette-red": roulette("red"),
+    "roulette-17": roulette("17"),
+}
+
+
+def game(name: str) -> Callable[[np.random.Generator, int], np.ndarray]:
+    if name in GAMES:
+        return GAMES[name]
+    if name.startswith("roulette-"):
+        return roulette(name.removeprefix("roulette-"))
+    raise ValueError(f"No game called {name}")
+
+
+# The same games a round at a time, through the functions the cogs call
+def play_slots(rng: random.Random, items: int) -> float:
+    return outcomes.slot_reward(outcomes.slot_stops(items, rng), 1) - 1
+
+
+def play_roulette(rng: random.Random, choice: str) -> float:
+    return outcomes.roulette_delta(choice, outcomes.spin_wheel(rng), 1)
+
+
+def play_flip(rng: random.Random) -> float:
+    return outcomes.flip_delta("h", outcomes.flip_coin(rng), 1)
+
+
+def play_roll(rng: random.Random) -> float:
+    return outcomes.roll_delta(1, outcomes.roll_die(rng), 1)
+
+
+def play_blackjack(rng: random.Random) -> float:
+    bet = 100
+    shoe = Shoe(rng=rng)
+    # Dealt player, dealer, player, dealer
+    player, dealer = [shoe.draw()], [shoe.draw()]
+    player.append(shoe.draw())
+    dealer.append(shoe.draw())
+    while True:
+        score = outcomes.hand_value(player)
+        outcome = outcomes.player_outcome(score, bet)
+        if outcome or score >= STAND_ON:
+            break
+        player.append(shoe.draw())
+    if outcome is None:
+        while outcomes.hand_value(dealer) < outcomes.DEALER_STANDS_ON:
+            dealer.append(shoe.draw())
+        outcome = outcomes.showdown(score, outcomes.hand_value(dealer), bet)
+    return (outcome.payout - bet) / bet
+
+
+def scalar(name: str) -> Callable[[random.Random], float]:
+    if name == "slots":
+        items = slot_items()
+        return lambda rng: play_slots(rng, items)
+    if name.startswith("roulette-"):
+        choice = name.removeprefix("roulette-")
+        return lambda rng: play_roulette(rng, choice)
+    return {"blackjack": play_blackjack, "flip": play_flip, "roll": play_roll}[name]
+
+
+class Report(NamedTuple):
+    rounds: int
+    seconds: float
+    # Rounds that won or lost each amount per unit bet
+    payouts: Dict[float, int]
+
+    @property
+    def mean(self) -> float:
+        return sum(net * count for net, count in self.payouts.items()) / self.rounds
+
+    @property
+    def rtp(self) -> float:
+        return 1 + self.mean
+
+    @property
+    def std(self) -> float:
+        square = sum(net * net * count for net, count in self.payouts.items())
+        return (square / self.rounds - self.mean**2) ** 0.5
+
+
+def simulate(name: str, rounds: int, seed: int = None) -> Report:
+    play = game(name)
+    rng = np.random.default_rng(seed)
+    payouts: Counter = Counter()
+    start = time.perf_counter()
+    for done in range(0, rounds, CHUNK):
+        nets, counts = np.unique(
+            play(rng, min(CHUNK, rounds - done)), return_counts=True
+        )
+        payouts.update(dict(zip(nets.tolist(), counts.tolist())))
+    return Report(rounds, time.perf_counter() - start, dict(payouts))
+
+
+def simulate_scalar(name: str, rounds: int, seed: int = None) -> Report:
+    play = scalar(name)
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    payouts = Counter(play(rng) for _ in range(rounds))
+    return Report(rounds, time.perf_counter() - start, dict(payouts))
+
+
+def print_report(label: str, report: Report):
+    print(
+        f"{label:<24}{report.rounds:>12,} rounds{report.seconds:>8.2f} s"
+        f"   RTP {report.rtp:>8.3%}   house edge {-report.mean:>8.3%}"
+        f"   std dev {report.std:>7.3f}"
+    )
+
+
+def print_payouts(report: Report):
+    for net, count in sorted(report.payouts.items()):
+        print(f"{'':<8}{net:>+8.2f} x bet{count / report.rounds:>10.4%}")
+
+
+def main(args: List[str]):
+    check = "--check" in args
+    args = [arg for arg in args if arg != "--check"]
+    rounds = 10_000_000
+    if args and args[0].isdigit():
+        rounds = int(args.pop(0))
+    names: Iterable[str] = args or GAMES
+    for name in names:
+        report = simulate(name, rounds)
+        print_report(name, report)
+        print_payouts(report)
+        if check:
+            # Pure Python is a few hundred times slower
+            print_report("  round by round", simulate_scalar(name, rounds // 100))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
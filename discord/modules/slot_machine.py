@@ -0,0 +1,272 @@
+import functools
+import io
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from PIL import Image, features
+
+FOLDER = Path(__file__).parent
+
+Stops = Tuple[int, int, int]
+
+SPINNING_FORMATS = ("gif", "webp")
+RESULT_FORMATS = ("gif", "webp", "png")
+
+
+class Animation(NamedTuple):
+    """Encoded images of one spin"""
+
+    spinning: bytes
+    result: bytes
+
+    @property
+    def size(self) -> int:
+        return len(self.spinning) + len(self.result)
+
+
+class AnimationCache:
+    """Encoded animations keyed by reel stops, least recently used dropped
+    first once they take up more than max_bytes.
+
+    Every access takes the lock, so it can be shared with threads."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._animations: OrderedDict[Stops, Animation] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __contains__(self, stops: Stops) -> bool:
+        return stops in self._animations
+
+    def __len__(self) -> int:
+        return len(self._animations)
+
+    def get(self, stops: Stops) -> Optional[Animation]:
+        with self._lock:
+            animation = self._animations.get(stops)
+            if animation is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self._animations.move_to_end(stops)
+            return animation
+
+    def put(self, stops: Stops, animation: Animation, evict: bool = True) -> bool:
+        """Caches the animation. With evict=False nothing already cached is
+        dropped to make room; returns whether the animation was kept."""
+        with self._lock:
+            if stops in self._animations:
+                return True
+            if animation.size > self.max_bytes or (
+                not evict and self.size + animation.size > self.max_bytes
+            ):
+                return False
+            self._animations[stops] = animation
+            self.size += animation.size
+            while self.size > self.max_bytes:
+                _, dropped = self._animations.popitem(last=False)
+                self.size -= dropped.size
+                self.counters["evictions"] += 1
+            return True
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return dict(
+            self.counters,
+            cached=len(self),
+            cached_bytes=self.size,
+            hit_rate=self.counters["hits"] / lookups if lookups else 0.0,
+        )
+
+
+class SlotMachine:
+    """The slot machine art, decoded and scaled down once.
+
+    The facade and reel are shared by every spin and never drawn on, so one
+    instance can serve every command. Since a spin's animation only depends
+    on where the reels stop, encoded animations are kept in an
+    AnimationCache of cache_mb megabytes.
+
+    The spin is encoded as spinning_format and the still of where the
+    reels stop as result_format. GIF and PNG frames are mapped onto one
+    palette worked out from the art up front, which is much faster than
+    letting PIL pick a palette per frame and keeps the frames identical
+    where nothing moved, so the GIF encoder can crop them down to what
+    changed.
+
+    Frames are drawn with NumPy. Every frame is the facade over three
+    windows onto the reel strip, so the windows of every frame of a spin
+    are sliced out of the strip with one fancy index and blended under
+    the facade in a few whole-array operations."""
+
+    # Height of one symbol on the reel strip, and how far it moves per frame
+    item = 180
+    speed = 30
+    # Where the reels' top left corner sits at the start of the spin
+    left = 25
+    top = 100
+    reels = 3
+    # Symbols on the reel, repeated down its length
+    symbols = 6
+
+    def __init__(
+        self,
+        folder: Path = FOLDER,
+        cache_mb: float = 32,
+        spinning_format: str = "gif",
+        result_format: str = "png",
+    ):
+        if spinning_format not in SPINNING_FORMATS:
+            raise ValueError(f"Can't animate the spin as {spinning_format}")
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Can't save the result as {result_format}")
+        if "webp" in (spinning_format, result_format) and not features.check("webp"):
+            raise ValueError("This Pillow was built without WebP support")
+        self.spinning_format = spinning_format
+        self.result_format = result_format
+        self.spinning_name = f"slot_spin.{spinning_format}"
+        self.result_name = f"slot_result.{result_format}"
+        facade = Image.open(folder / "slot-face.png").convert("RGBA")
+        reel = Image.open(folder / "slot-reel.png").convert("RGBA")
+        self.facade = facade.resize(
+            (facade.width // 2, facade.height // 2), Image.LANCZOS
+        )
+        self.reel = reel.resize((reel.width // 2, reel.height // 2), Image.LANCZOS)
+        # Number of stop positions on the reel
+        self.items = self.reel.height // self.item
+        self.cache = AnimationCache(int(cache_mb * 1024 * 1024))
+        self._compositor()
+
+    def _compositor(self):
+        """Arrays for frames(), worked out from the art once"""
+        facade = np.asarray(self.facade).astype(np.uint16)
+        colour, alpha = facade[..., :3], facade[..., 3:]
+        # The facade over white, which every frame shows wherever the reels
+        # aren't seen through it
+        self._backdrop = ((colour * alpha + 255 * (255 - alpha) + 127) // 255).astype(
+            np.uint8
+        )
+        # The box around every pixel the reels show through, the only part
+        # of a frame that changes
+        span = slice(self.left, self.left + self.reels * self.reel.width)
+        ys, xs = np.nonzero(alpha[:, span, 0] < 255)
+        self._box = (
+            slice(ys.min(), ys.max() + 1),
+            slice(self.left + xs.min(), self.left + xs.max() + 1),
+        )
+        self._box_colour = colour[self._box] * alpha[self._box] + 127
+        # Repeated per channel: broadcasting a trailing axis of 1 is slow
+        self._box_alpha = np.repeat(255 - alpha[self._box], 3, axis=2)
+
+        # The reel is opaque, so only its colour matters. White above and
+        # below the strip, for frames where it has scrolled past the box.
+        reel = np.asarray(self.reel.convert("RGB"))
+        white = np.full((self.facade.height, *reel.shape[1:]), 255, dtype=np.uint8)
+        self._strip = np.concatenate([white, reel, white])
+        # Read-only view of every box-high window onto the strip, so one
+        # fancy index picks out the window of each reel in each frame
+        rows = self._box[0].stop - self._box[0].start
+        self._windows = as_strided(
+            self._strip,
+            shape=(len(self._strip) - rows + 1, rows, *reel.shape[1:]),
+            strides=(self._strip.strides[0], *self._strip.strides),
+            writeable=False,
+        )
+
+    @functools.cached_property
+    def palette(self) -> Image.Image:
+        """256 colours picked from the reel and facade on white, the
+        background every frame is drawn on"""
+        art = Image.new(
+            "RGB",
+            (self.reel.width + self.facade.width, self.reel.height),
+            color=(255, 255, 255),
+        )
+        art.paste(self.reel, (0, 0), self.reel)
+        art.paste(self.facade, (self.reel.width, 0), self.facade)
+        return art.quantize(256, method=Image.Quantize.MEDIANCUT)
+
+    def frames(self, stops: Stops) -> List[Image.Image]:
+        """Every frame of the spin, the last one showing where the reels stop"""
+        box_rows, box_columns = self._box
+        steps = np.arange(1, (self.item // self.speed) + 1)
+        # (frame, reel) -> y of the strip's top edge in the frame
+        tops = self.top - self.speed * steps[:, None] * np.array(stops)[None, :]
+        # (frame, reel, y, x, rgb), then the reels side by side
+        windows = self._windows[box_rows.start - tops + self.facade.height]
+        windows = windows.transpose(0, 2, 1, 3, 4).reshape(
+            len(steps), windows.shape[2], -1, 3
+        )
+        windows = windows[
+            :, :, box_columns.start - self.left : box_columns.stop - self.left
+        ]
+
+        # (colour * alpha + reel * (255 - alpha) + 127) // 255, the division
+        # done with shifts, exact below 2**16
+        box = windows * self._box_alpha
+        box += self._box_colour
+        box += 1 + (box >> 8)
+        box >>= 8
+        canvas = np.repeat(self._backdrop[None], len(steps), axis=0)
+        canvas[:, box_rows, box_columns] = box
+        return [Image.fromarray(frame) for frame in canvas]
+
+    def encode(
+        self, images: List[Image.Image], format: str, duration: int, loop: int
+    ) -> bytes:
+        options = {}
+        if format == "webp":
+            options["quality"] = 80
+        else:
+            images = [
+                image.quantize(palette=self.palette, dither=Image.Dither.NONE)
+                for image in images
+            ]
+        if format != "png":
+            options.update(
+                save_all=True, append_images=images[1:], duration=duration, loop=loop
+            )
+        with io.BytesIO() as image_binary:
+            images[0].save(image_binary, format=format.upper(), **options)
+            return image_binary.getvalue()
+
+    def render(self, stops: Stops) -> Animation:
+        """Draws and encodes the spin, bypassing the cache"""
+        images = self.frames(stops)
+        return Animation(
+            self.encode(images[:-1], self.spinning_format, duration=430, loop=1),
+            self.encode(images[-1:], self.result_format, duration=1000, loop=0),
+        )
+
+    def lined_up(self, symbol: int) -> Iterator[Stops]:
+        """Every way the reels can stop with the symbol on all three"""
+        stops = range(symbol + self.symbols, self.items, self.symbols)
+        return ((s1, s2, s3) for s1 in stops for s2 in stops for s3 in stops)
+
+    def warm_order(self, weights: Iterable[float]) -> Iterator[Stops]:
+        """Winning stops, most likely symbol first. weights are the chances
+        of each symbol given a win; losing stops are spread evenly over
+        thousands of positions, so are never worth rendering ahead."""
+        ranked = sorted(enumerate(weights), key=lambda item: item[1], reverse=True)
+        for symbol, _ in ranked:
+            yield from self.lined_up(symbol)
+
+
+@functools.lru_cache(maxsize=None)
+def _machine(spinning_format: str, result_format: str) -> SlotMachine:
+    return SlotMachine(
+        cache_mb=0, spinning_format=spinning_format, result_format=result_format
+    )
+
+
+def render_spin(
+    stops: Stops, spinning_format: str = "gif", result_format: str = "png"
+) -> Animation:
+    """Render job for RenderService, with the art loaded once per worker"""
+    return _machine(spinning_format, result_format).render(stops)